@@ -1,9 +1,54 @@
 # Alejandro Castro Project
+import calendar
+import datetime
+import functools
+import hashlib
+import io
+import itertools
+import json
+import logging
+import multiprocessing
+import os
+import threading
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from contextlib import ExitStack, contextmanager
+
+import numpy as np
 import pandas as pd
-import plotly.graph_objects as go
+import psycopg2.extensions
 import psycopg2.extras
+import psycopg2.pool
 import streamlit as st
-import yfinance as yf
+
+from chart_thumbnails import render_thumbnail
+
+# Threads started by the app get the context of the rerun, so the Streamlit calls they make belong to it. Its import
+# path changed between Streamlit versions, without it the threads still run the same way.
+try:
+    from streamlit.scriptrunner import add_script_run_ctx, get_script_run_ctx
+except ImportError:
+    try:
+        from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+    except ImportError:
+        def add_script_run_ctx(thread=None, ctx=None):
+            return thread
+
+        def get_script_run_ctx():
+            return None
+
+# Locks on files shared with other processes, like nightly_refresh.py running next to the server. fcntl only exists on
+# Unix, elsewhere the file locks are skipped and only the locks within the process remain.
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# Plotly, yfinance and pyarrow are imported inside the tabs and functions that use them, so the 🏠 Home tab does not
+# pay for them. The start time of the rerun is used to measure how long every tab takes to show its first element.
+SCRIPT_START_TIME = time.perf_counter()
+logger = logging.getLogger("portfolio_app")
 
 st.set_page_config(
     page_title="Alex Castro Portfolio",
@@ -17,116 +62,1699 @@ option = st.sidebar.selectbox('What would you like to do?',
 st.sidebar.text_area(label="Notes", placeholder="Please feel free to use the following text area for note taking.")
 
 
-# Passing secret variables to connect to the Database
-def init_connection():
-    return psycopg2.connect(**st.secrets["wbets"])
+# Function that reports the time to first paint of the tab, from the start of the rerun until the tab shows its
+# first element. The time of the first visit of every tab in the session is kept to compare it with later reruns.
+def record_first_paint(tab_name):
+    first_paint_ms = (time.perf_counter() - SCRIPT_START_TIME) * 1000
+    first_visit_ms = st.session_state.setdefault("first_paint_ms", {}).setdefault(tab_name, first_paint_ms)
+    st.sidebar.caption(f"⏱️ First paint: {first_paint_ms:.0f} ms (first visit: {first_visit_ms:.0f} ms)")
+    logger.info("first paint of %s: %.1f ms", tab_name, first_paint_ms)
+    return first_paint_ms
+
+
+# Database settings: size of the connection pool shared by every session, seconds a connection can sit idle before
+# it gets health-checked again, the timeout Postgres enforces on every statement, and how many times a query is
+# retried on a new connection when the server drops the current one
+DB_POOL_MIN_CONNECTIONS = 1
+DB_POOL_MAX_CONNECTIONS = 10
+DB_HEALTHCHECK_INTERVAL = 30
+DB_STATEMENT_TIMEOUT_MS = 30000
+DB_CONNECT_RETRIES = 2
+
+# Rows fetched per round trip by the server-side cursors that stream large results
+DB_STREAM_ITERSIZE = 2000
+
+# Full-text search expression of the mentions, with the message weighing more than the author. The GIN index is built
+# on this exact expression, and queries have to use it as it is for Postgres to pick the index.
+MENTION_SEARCH_VECTOR = ("setweight(to_tsvector('english', coalesce(message, '')), 'A') || "
+                         "setweight(to_tsvector('english', coalesce(author, '')), 'B')")
+
+# Indexes created by the nightly job with CREATE INDEX CONCURRENTLY, by name, with the table and columns they cover
+DATABASE_INDEXES = {
+    "data_stocks_daily_symbol_date_idx": "data_stocks_daily (symbol, date)",
+    "mention_dt_id_idx": "mention (dt DESC, id DESC)",
+    "mention_stock_dt_id_idx": "mention (stock_id, dt DESC, id DESC)",
+    "mention_search_idx": f"mention USING GIN (({MENTION_SEARCH_VECTOR}))",
+}
+
+# Number of Reddit mentions shown on each page of the 🚀 Wallstreetbets tab, and the most recent matches of a search
+# that get ranked, where the count of matches stops
+MENTIONS_PAGE_SIZE = 100
+MENTION_SEARCH_CANDIDATES = 1000
+
+# Seconds between incremental refreshes of the in-memory mention index
+MENTION_INDEX_REFRESH_SECONDS = 600
+
+# Local on-disk store with the price history of every symbol searched, kept as memory-mapped .npy files, and the
+# number of calendar days of history the 🔎 Search for Stocks tab works with
+OHLC_STORE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".ohlc_store")
+OHLC_STORE_COLUMNS = ["open", "high", "low", "close"]
+OHLC_COPY_DTYPES = {"symbol": "category", **dict.fromkeys(OHLC_STORE_COLUMNS, np.float64)}
+SEARCH_HISTORY_DAYS = 3650
+
+# Symbols synced together with a single query by the nightly job, and the periods of the comparison mode in days
+STORE_SYNC_BATCH = 200
+COMPARISON_PERIODS = {"1 Month": 30, "3 Months": 91, "6 Months": 182, "1 Year": 365, "3 Years": 1095,
+                      "5 Years": 1826, "10 Years": 3650}
+
+# Resolutions precomputed from the daily bars of the local store, together with their percent of change
+PYRAMID_LEVELS = ["week", "month", "year"]
+PYRAMID_COLUMNS = OHLC_STORE_COLUMNS + ["percent_change"]
+
+# Minimum width in pixels of every candle of the candlestick chart, which sets how many candles fit in the chart
+CHART_CANDLE_PIXELS = 5
+
+# Indicators kept in memory to be extended with new bars, and bars per year of every timescale for the volatility
+INDICATOR_CACHE_ENTRIES = 512
+PERIODS_PER_YEAR = {"Day": 252, "Week": 52, "Month": 12, "Year": 1}
+
+# Width of the bins of the probability chart, one percent of change, and quantiles listed with the distribution
+HISTOGRAM_BIN_WIDTH = 0.01
+DISTRIBUTION_QUANTILES = [0.05, 0.25, 0.5, 0.75, 0.95]
+
+# Exports of the historic dataset: folder where the files are built, rows written at a time, extension and mime type
+# of every format, and hours an export is kept before it is cleaned up
+EXPORT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".exports")
+EXPORT_CHUNK_ROWS = 50000
+EXPORT_FORMATS = {"CSV": ("csv", "text/csv"),
+                  "Parquet": ("parquet", "application/octet-stream"),
+                  "Arrow IPC": ("arrow", "application/vnd.apache.arrow.file")}
+EXPORT_MAX_AGE_HOURS = 24
+
+# Company profiles from Yahoo Finance cached on disk, the seconds before a profile gets refreshed, and the number of
+# threads used to fetch profiles in the background
+COMPANY_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".company_cache")
+COMPANY_INFO_TTL = 7 * 86400
+COMPANY_PREFETCH_WORKERS = 8
+
+# Threads shared by every session to run the independent loads of a tab at the same time
+FETCH_WORKERS = 8
+
+# Calendar days of history loaded for every symbol by the candlestick pattern scanner of the 📈 Trending tab
+SCANNER_HISTORY_DAYS = 400
+
+# Chart thumbnails of the 📈 Trending tab drawn from our own bars: folder where they are cached, candles drawn, size
+# in pixels, thumbnails on every row and page of the grid, hours a thumbnail is kept after it was last used, and the
+# processes that draw them
+THUMBNAIL_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".thumbnail_cache")
+THUMBNAIL_BARS = 60
+THUMBNAIL_SIZE = (320, 160)
+THUMBNAIL_COLUMNS = 4
+THUMBNAILS_PER_PAGE = 24
+THUMBNAIL_MAX_AGE_HOURS = 72
+THUMBNAIL_WORKERS = 4
+
+# Screener of the 📈 Trending tab: folder of the memory-mapped matrix with the close of every symbol (rows) on every
+# trading day (columns), calendar days of history it keeps when it is built, and spare day columns reserved so the
+# days that come in are appended in place until the matrix gets built again
+SCREENER_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".screener_store")
+SCREENER_HISTORY_DAYS = 400
+SCREENER_SPARE_DAYS = 260
+
+
+# Passing secret variables to build a bounded pool of connections to the Database, created once per server process.
+# ThreadedConnectionPool raises an error once every connection is checked out, so the semaphore makes extra sessions
+# wait for a free connection instead.
+@st.experimental_singleton
+def init_connection_pool():
+    connection_settings = dict(st.secrets["wbets"])
+    connection_settings.setdefault("options", f"-c statement_timeout={DB_STATEMENT_TIMEOUT_MS}")
+    connection_pool = psycopg2.pool.ThreadedConnectionPool(DB_POOL_MIN_CONNECTIONS, DB_POOL_MAX_CONNECTIONS,
+                                                           **connection_settings)
+    return {"pool": connection_pool,
+            "slots": threading.BoundedSemaphore(DB_POOL_MAX_CONNECTIONS),
+            "last_used": {}}
+
+
+# Function to make sure a connection checked out of the pool is still alive. Connections that were closed, or that
+# fail a quick ping after being idle for a while, are dropped from the pool and replaced with a new one.
+def check_connection_health(db, connection):
+    idle_time = time.monotonic() - db["last_used"].get(id(connection), 0)
+    if not connection.closed and idle_time < DB_HEALTHCHECK_INTERVAL:
+        return connection
+    try:
+        if not connection.closed:
+            with connection.cursor() as ping_cursor:
+                ping_cursor.execute("SELECT 1")
+            connection.rollback()
+            return connection
+    except (psycopg2.OperationalError, psycopg2.InterfaceError):
+        pass
+    db["pool"].putconn(connection, close=True)
+    return db["pool"].getconn()
+
+
+# Function that checks a connection out of the pool and hands a new cursor to the caller, so every session runs its
+# queries on its own cursor. The transaction is committed when the block finishes, and a connection that breaks in
+# the middle of a query is discarded so the next call reconnects. Giving a name opens a server-side cursor, which is
+# rolled back as well when the stream reading it is closed early.
+@contextmanager
+def db_cursor(cursor_factory=psycopg2.extras.DictCursor, name=None):
+    db = init_connection_pool()
+    with db["slots"]:
+        connection = check_connection_health(db, db["pool"].getconn())
+        broken_connection = False
+        try:
+            with connection.cursor(name=name, cursor_factory=cursor_factory) as cursor:
+                yield cursor
+            connection.commit()
+        except psycopg2.extensions.QueryCanceledError:
+            connection.rollback()
+            raise
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            broken_connection = True
+            raise
+        except BaseException:
+            if not connection.closed:
+                connection.rollback()
+            raise
+        finally:
+            db["last_used"][id(connection)] = time.monotonic()
+            db["pool"].putconn(connection, close=broken_connection or bool(connection.closed))
+
+
+# Decorator that runs a database function again on a new connection when the server dropped the previous one.
+# Queries cancelled by the statement timeout are not retried.
+def retry_on_disconnect(func):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        for attempt in range(DB_CONNECT_RETRIES + 1):
+            try:
+                return func(*args, **kwargs)
+            except psycopg2.extensions.QueryCanceledError:
+                raise
+            except (psycopg2.OperationalError, psycopg2.InterfaceError):
+                if attempt == DB_CONNECT_RETRIES:
+                    raise
+                time.sleep(0.5 * (attempt + 1))
+
+    return wrapper
+
+
+# Generator that streams the rows of a query as plain tuples through a named server-side cursor, itersize rows per
+# round trip, so only one batch is held in memory at a time
+def stream_rows(query, params=None, itersize=DB_STREAM_ITERSIZE):
+    with db_cursor(cursor_factory=None, name=f"stream_{threading.get_ident()}_{time.time_ns()}") as cursor:
+        cursor.itersize = itersize
+        cursor.execute(query, params)
+        yield from cursor
+
+
+# Function to fetch a large result with COPY ... TO STDOUT. Postgres streams the rows as CSV text that pandas parses
+# straight into typed columns, instead of building a tuple of Python objects and a Decimal for every value. Only
+# empty fields are read as missing, so a symbol like NA stays a symbol.
+def copy_query_frame(query, params=None, dtype=None, parse_dates=None):
+    buffer = io.BytesIO()
+    with db_cursor(cursor_factory=None) as cursor:
+        cursor.copy_expert(f"COPY ({cursor.mogrify(query, params).decode()}) TO STDOUT WITH CSV HEADER", buffer)
+    buffer.seek(0)
+    return pd.read_csv(buffer, dtype=dtype, parse_dates=parse_dates, keep_default_na=False, na_values=[""])
+
+
+# Recursive query that lists the symbols of data_stocks_daily with one probe of its (symbol, date) index per symbol,
+# jumping from every symbol straight to the next one instead of reading all of their bars. It is the first CTE of a
+# WITH RECURSIVE query, and the last row it returns is NULL.
+PRICE_SYMBOLS_CTE = """
+    price_symbols AS (
+        (SELECT symbol FROM data_stocks_daily ORDER BY symbol LIMIT 1)
+        UNION ALL
+        SELECT (SELECT d.symbol FROM data_stocks_daily d WHERE d.symbol > price_symbols.symbol
+                ORDER BY d.symbol LIMIT 1)
+        FROM price_symbols
+        WHERE price_symbols.symbol IS NOT NULL)"""
+
+
+# Diagnostics: every data function and chart step is timed, with the rows and bytes of what it returned, and added
+# to counters shared by every session. The panel in the side bar is hidden, open the app with ?diagnostics=1 to see
+# it. Every step is also logged as a JSON line on the portfolio_app.metrics logger for offline analysis.
+RERUN_METRICS = []
+metrics_state = threading.local()
+metrics_logger = logging.getLogger("portfolio_app.metrics")
+METRIC_COUNTERS = [("calls", "portfolio_app_step_calls_total", "Times the step ran"),
+                   ("seconds", "portfolio_app_step_seconds_total", "Seconds spent in the step"),
+                   ("rows", "portfolio_app_step_rows_total", "Rows returned by the step"),
+                   ("bytes", "portfolio_app_step_bytes_total", "Bytes returned by the step"),
+                   ("cache_hits", "portfolio_app_cache_hits_total", "Calls answered from the memo cache"),
+                   ("cache_misses", "portfolio_app_cache_misses_total", "Calls that ran the function")]
+
+
+# Counters of every step since the server started, shared by every session
+@st.experimental_singleton
+def get_metrics():
+    return {"lock": threading.Lock(), "steps": {}}
+
+
+# Function to find the rows and bytes of a result without copying or pickling it
+def measure_result(result):
+    if isinstance(result, pd.DataFrame):
+        return len(result.index), int(result.memory_usage(index=True).sum())
+    if isinstance(result, np.ndarray):
+        return len(result), result.nbytes
+    if isinstance(result, dict):
+        arrays = [value for value in result.values() if isinstance(value, np.ndarray)]
+        if arrays:
+            return max(len(array) for array in arrays), sum(array.nbytes for array in arrays)
+    if isinstance(result, list):
+        return len(result), None
+    return None, None
+
+
+# Function to add a step to the breakdown of the rerun, the counters of the server and the JSON log
+def record_step(step, seconds, rows=None, size_bytes=None, cached=None):
+    entry = {"step": step, "seconds": round(seconds, 6), "rows": rows, "bytes": size_bytes, "cached": cached}
+    RERUN_METRICS.append(entry)
+    metrics = get_metrics()
+    with metrics["lock"]:
+        counters = metrics["steps"].setdefault(step, dict.fromkeys((name for name, _, _ in METRIC_COUNTERS), 0))
+        counters["calls"] += 1
+        counters["seconds"] += seconds
+        counters["rows"] += rows or 0
+        counters["bytes"] += size_bytes or 0
+        if cached is not None:
+            counters["cache_hits" if cached else "cache_misses"] += 1
+    metrics_logger.info(json.dumps(entry))
+
+
+# Context manager that times a step. The step can leave what it returned in measurement["result"] to count its rows
+# and bytes.
+@contextmanager
+def measure(step):
+    measurement = {"result": None, "cached": None}
+    start_time = time.perf_counter()
+    try:
+        yield measurement
+    finally:
+        rows, size_bytes = measure_result(measurement["result"])
+        record_step(step, time.perf_counter() - start_time, rows, size_bytes, measurement["cached"])
+
+
+# Decorator that measures every call of a function
+def instrument(func):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with measure(func.__name__) as measurement:
+            measurement["result"] = func(*args, **kwargs)
+        return measurement["result"]
+
+    return wrapper
+
+
+# Decorator used instead of st.experimental_memo. It measures every call, and the function only runs on a cache miss,
+# which is how hits and misses are told apart. Memo functions calling each other keep their own flag.
+def instrumented_memo(**memo_options):
+    def decorator(func):
+        @functools.wraps(func)
+        def run_on_cache_miss(*args, **kwargs):
+            metrics_state.cache_miss = True
+            return func(*args, **kwargs)
+
+        cached_func = st.experimental_memo(**memo_options)(run_on_cache_miss)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            caller_cache_miss = getattr(metrics_state, "cache_miss", False)
+            metrics_state.cache_miss = False
+            try:
+                with measure(func.__name__) as measurement:
+                    measurement["result"] = cached_func(*args, **kwargs)
+                    measurement["cached"] = not metrics_state.cache_miss
+            finally:
+                metrics_state.cache_miss = caller_cache_miss
+            return measurement["result"]
+
+        wrapper.clear = cached_func.clear
+        return wrapper
+
+    return decorator
+
+
+# Function to write the counters of the server in the Prometheus text format
+def format_prometheus_metrics():
+    metrics = get_metrics()
+    with metrics["lock"]:
+        steps = {step: dict(counters) for step, counters in metrics["steps"].items()}
+    lines = []
+    for name, metric_name, help_text in METRIC_COUNTERS:
+        lines += [f"# HELP {metric_name} {help_text}", f"# TYPE {metric_name} counter"]
+        lines += [f'{metric_name}{{step="{step}"}} {counters[name]}' for step, counters in sorted(steps.items())]
+    return "\n".join(lines) + "\n"
+
+
+# Diagnostics panel with the steps of this rerun and the counters of the server, shown with ?diagnostics=1
+def render_diagnostics_panel():
+    # Without a script run context (bare mode, as in the nightly job) there are no query params to read
+    if get_script_run_ctx() is None or st.experimental_get_query_params().get("diagnostics") != ["1"]:
+        return
+    with st.sidebar.expander("🩺 Diagnostics", expanded=True):
+        rerun_df = pd.DataFrame(RERUN_METRICS, columns=["step", "seconds", "rows", "bytes", "cached"])
+        st.caption(f"This rerun: {len(rerun_df.index)} steps, {(time.perf_counter() - SCRIPT_START_TIME):.2f} s")
+        st.dataframe(rerun_df)
+        metrics = get_metrics()
+        with metrics["lock"]:
+            totals_df = pd.DataFrame.from_dict(metrics["steps"], orient="index")
+        st.caption("Since the server started")
+        st.dataframe(totals_df)
+        st.download_button("Prometheus metrics", format_prometheus_metrics(), file_name="metrics.prom",
+                           mime="text/plain")
+        st.download_button("JSON", json.dumps({"rerun": RERUN_METRICS, "totals": totals_df.to_dict("index")},
+                                              default=str), file_name="metrics.json", mime="application/json")
 
 
-connection = init_connection()
-cursor = connection.cursor(cursor_factory=psycopg2.extras.DictCursor)
+# Tab 🔎 Search for Stocks
+# Context manager that holds an exclusive lock on a lock file, shared by every process of the machine. The lock is
+# released when the file is closed, also when the process dies.
+@contextmanager
+def file_lock(lock_path):
+    os.makedirs(os.path.dirname(lock_path), exist_ok=True)
+    with open(lock_path, "a") as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        yield
 
 
 # Tab 🔎 Search for Stocks
-# Function to fetch the historical dataset for selected stock
-@st.experimental_memo(ttl=86400, show_spinner=True)
+# One lock per symbol shared by every session, so two sessions never write the same symbol's files at the same time.
+# The lock file of the symbol folder keeps the nightly job and the server from writing them at the same time too.
+@st.experimental_singleton
+def get_store_locks():
+    return {"guard": threading.Lock(), "symbols": {}}
+
+
+@contextmanager
+def store_lock(ticker):
+    locks = get_store_locks()
+    with locks["guard"]:
+        thread_lock = locks["symbols"].setdefault(ticker, threading.Lock())
+    with thread_lock, file_lock(os.path.join(OHLC_STORE_DIR, ticker, ".lock")):
+        yield
+
+
+# Tab 🔎 Search for Stocks
+# Function to read the meta.json of a symbol, which keeps the current files and watermark of every level
+def read_store_meta(ticker):
+    meta_path = os.path.join(OHLC_STORE_DIR, ticker, "meta.json")
+    if not os.path.exists(meta_path):
+        return {}
+    with open(meta_path) as meta_file:
+        return json.load(meta_file)
+
+
+# Tab 🔎 Search for Stocks
+# Function to read the arrays stored for a symbol. meta.json points to the files of the latest version, and the
+# files are memory-mapped so nothing is copied until the data is used. Readers don't take the lock, so when a writer
+# swaps meta.json and removes the previous files right after it was read, meta.json is read again.
+def read_store_arrays(ticker, level):
+    for attempt in range(2):
+        meta = read_store_meta(ticker)
+        if level not in meta:
+            return None, None
+        file_prefix = os.path.join(OHLC_STORE_DIR, ticker, meta[level]["file"])
+        try:
+            return np.load(f"{file_prefix}.date.npy", mmap_mode="r"), np.load(f"{file_prefix}.bars.npy", mmap_mode="r")
+        except FileNotFoundError:
+            if attempt:
+                raise
+
+
+# Tab 🔎 Search for Stocks
+# Function to save a new version of a symbol's arrays, called with the store_lock of the symbol held. Every version
+# gets its own files and meta.json is swapped in afterwards, so readers that still have the previous files
+# memory-mapped are not affected.
+def write_store_arrays(ticker, level, dates, bars, **meta_fields):
+    symbol_dir = os.path.join(OHLC_STORE_DIR, ticker)
+    os.makedirs(symbol_dir, exist_ok=True)
+    meta_path = os.path.join(symbol_dir, "meta.json")
+    meta = read_store_meta(ticker)
+
+    watermark = str(dates[-1])
+    file_name = f"{level}-{watermark}-{time.time_ns()}"
+    np.save(os.path.join(symbol_dir, f"{file_name}.date.npy"), np.ascontiguousarray(dates, dtype="datetime64[D]"))
+    np.save(os.path.join(symbol_dir, f"{file_name}.bars.npy"), np.ascontiguousarray(bars, dtype=np.float64))
+    meta[level] = {"file": file_name, "last_date": watermark, "rows": len(dates), **meta_fields}
+    with open(f"{meta_path}.tmp", "w") as meta_file:
+        json.dump(meta, meta_file)
+    os.replace(f"{meta_path}.tmp", meta_path)
+
+    # Files still memory-mapped somewhere cannot be removed on every platform, those are cleaned up on the next write
+    for stale_file in os.listdir(symbol_dir):
+        if stale_file.startswith(f"{level}-") and not stale_file.startswith(f"{file_name}."):
+            try:
+                os.remove(os.path.join(symbol_dir, stale_file))
+            except OSError:
+                pass
+
+
+# Tab 🔎 Search for Stocks
+# Function that brings the local store of several symbols up to date with a single query. Only the bars newer than
+# the last date already stored for every symbol (its watermark) are fetched, passed to Postgres as two arrays that
+# get joined with unnest, so restarting the app never downloads the history again. Returns the new watermarks.
+@retry_on_disconnect
+def fetch_into_stores(tickers):
+    tickers = sorted(set(tickers))
+    first_day = np.datetime64("today", "D") - np.timedelta64(SEARCH_HISTORY_DAYS - 1, "D")
+    with ExitStack() as locks:
+        for ticker in tickers:
+            locks.enter_context(store_lock(ticker))
+        stored = {ticker: read_store_arrays(ticker, "day") for ticker in tickers}
+        since = [str(dates[-1] + np.timedelta64(1, "D")) if dates is not None and len(dates) else str(first_day)
+                 for dates, _ in stored.values()]
+        new_rows = copy_query_frame("""
+                select d.symbol, date(d.date) as date, d.open, d.high, d.low, d.close
+                from data_stocks_daily d
+                join unnest(%s::text[], %s::date[]) as watermark(symbol, since) on d.symbol = watermark.symbol
+                where d.date >= watermark.since
+                order by d.symbol, d.date asc""", (tickers, since), dtype=OHLC_COPY_DTYPES, parse_dates=["date"])
+        new_row_dates = new_rows["date"].to_numpy(dtype="datetime64[D]")
+        new_row_bars = new_rows[OHLC_STORE_COLUMNS].to_numpy(dtype=np.float64)
+        rows_by_ticker = new_rows.groupby("symbol", observed=True).indices
+
+        watermarks = {}
+        for ticker, (dates, bars) in stored.items():
+            ticker_rows = rows_by_ticker.get(ticker)
+            if ticker_rows is not None and len(ticker_rows):
+                new_dates = new_row_dates[ticker_rows]
+                new_bars = new_row_bars[ticker_rows]
+                if dates is not None and len(dates):
+                    new_dates = np.concatenate((dates, new_dates))
+                    new_bars = np.concatenate((bars, new_bars))
+                write_store_arrays(ticker, "day", new_dates, new_bars)
+                dates = new_dates
+            watermarks[ticker] = str(dates[-1]) if dates is not None and len(dates) else None
+    return watermarks
+
+
+# Tab 🔎 Search for Stocks
+# Functions to sync the local store of one symbol, or of several symbols at once, cached for an hour. The sync of one
+# symbol runs in the fetch threads, which can't draw a spinner in the page, so the tab shows its own while it waits.
+@instrumented_memo(ttl=3600, show_spinner=False)
+def sync_ohlc_store(ticker):
+    return fetch_into_stores([ticker])[ticker]
+
+
+@instrumented_memo(ttl=3600, show_spinner=True)
+def sync_ohlc_stores(tickers):
+    return fetch_into_stores(tickers)
+
+
+# Tab 🔎 Search for Stocks
+# Function to fetch the historical dataset for selected stock. The local store is synced first and the DataFrame is
+# then built on top of the memory-mapped arrays, without copying the prices.
+@instrument
 def get_data_search(ticker):
-    data_full_set = cursor.execute("""
-                select date(date) as date, open, high, low, close
-                from data_stocks_daily
-                where symbol = %s
-                and date(date) > current_date - interval '%s day'
-                order by date asc""", (ticker.upper(), 3650,))
+    ticker = ticker.upper()
+    sync_ohlc_store(ticker)
+    dates, bars = read_store_arrays(ticker, "day")
+    if dates is None:
+        return pd.DataFrame(columns=["date"] + OHLC_STORE_COLUMNS)
 
-    columns = [col[0] for col in cursor.description]
-    rows = [dict(zip(columns, row)) for row in cursor.fetchall()]
-    return rows
+    first_day = np.datetime64("today", "D") - np.timedelta64(SEARCH_HISTORY_DAYS, "D")
+    first_row = np.searchsorted(dates, first_day, side="right")
+    df = pd.DataFrame(bars[first_row:], columns=OHLC_STORE_COLUMNS, copy=False)
+    df.insert(0, "date", pd.to_datetime(dates[first_row:]))
+    return df
+
+
+# Tab 🔎 Search for Stocks
+# Function to aggregate daily bars into weekly, monthly or yearly candles. Every bar is labeled with the first day of
+# its period as an integer date (weeks start on Monday), and since the bars are sorted by date each period is a
+# contiguous run that gets reduced with ufunc.reduceat, instead of formatting every date into a string for a groupby.
+@instrument
+def resample_ohlc(dates, bars, timeframe):
+    days = np.asarray(dates, dtype="datetime64[D]")
+    if len(days) == 0 or timeframe == "Day":
+        return days, np.asarray(bars, dtype=np.float64)
+    if timeframe == "Week":
+        period_start = days - ((days.astype(np.int64) + 3) % 7).astype("timedelta64[D]")
+    elif timeframe == "Month":
+        period_start = days.astype("datetime64[M]").astype("datetime64[D]")
+    else:
+        period_start = days.astype("datetime64[Y]").astype("datetime64[D]")
+
+    starts = np.flatnonzero(np.concatenate(([True], period_start[1:] != period_start[:-1])))
+    ends = np.concatenate((starts[1:], [len(days)])) - 1
+    resampled_bars = np.column_stack((bars[starts, 0],
+                                      np.maximum.reduceat(bars[:, 1], starts),
+                                      np.minimum.reduceat(bars[:, 2], starts),
+                                      bars[ends, 3]))
+    return period_start[starts], resampled_bars
+
+
+# Tab 🔎 Search for Stocks
+# Function that keeps the Week, Month and Year candles of a symbol stored next to its daily bars. Every period but
+# the last one is final, so only the bars from the start of the last stored period onwards are aggregated again.
+# The watermark of the daily bars is part of the cache key, so this runs once for every new batch of bars. It runs in
+# the fetch threads too, so it draws no spinner.
+@instrumented_memo(max_entries=4096, show_spinner=False)
+def refresh_ohlc_pyramid(ticker, watermark):
+    with store_lock(ticker):
+        dates, bars = read_store_arrays(ticker, "day")
+        if dates is None or len(dates) == 0:
+            return None
+        meta = read_store_meta(ticker)
+        for level in PYRAMID_LEVELS:
+            if meta.get(level, {}).get("source_last_date") == str(dates[-1]):
+                continue
+            level_dates, level_bars = read_store_arrays(ticker, level)
+            first_row, periods_kept = 0, 0
+            if level_dates is not None and len(level_dates):
+                first_row = np.searchsorted(dates, level_dates[-1])
+                periods_kept = len(level_dates) - 1
+
+            period_start, period_bars = resample_ohlc(dates[first_row:], bars[first_row:], level.capitalize())
+            percent_change = (period_bars[:, 3] - period_bars[:, 0]) / period_bars[:, 0]
+            period_bars = np.column_stack((period_bars, percent_change))
+            if periods_kept:
+                period_start = np.concatenate((level_dates[:periods_kept], period_start))
+                period_bars = np.concatenate((level_bars[:periods_kept], period_bars))
+            write_store_arrays(ticker, level, period_start, period_bars, source_last_date=str(dates[-1]))
+    return watermark
+
+
+# Tab 🔎 Search for Stocks
+# Function to bring in the dataset for the 🔎 Search for Stocks tab at the resolution the user selected. Daily bars
+# are served straight from the local store and the other timescales are read from the precomputed pyramid, so
+# switching the Timescale never aggregates the history again.
+@instrument
+def get_search_bars(ticker, timeframe):
+    ticker = ticker.upper()
+    if timeframe == 'Day':
+        df = get_data_search(ticker)
+        df['percent_change'] = ((df['close'] - df['open']) / df['open'])
+        return df
+
+    refresh_ohlc_pyramid(ticker, sync_ohlc_store(ticker))
+    dates, bars = read_store_arrays(ticker, timeframe.lower())
+    if dates is None:
+        return pd.DataFrame(columns=["date"] + PYRAMID_COLUMNS)
+    first_day = np.datetime64("today", "D") - np.timedelta64(SEARCH_HISTORY_DAYS, "D")
+    first_row = np.searchsorted(dates, first_day)
+    df = pd.DataFrame(bars[first_row:, :4], columns=OHLC_STORE_COLUMNS, copy=False)
+    df.insert(0, 'date', pd.to_datetime(dates[first_row:]))
+    # The memory-mapped files are read-only, percent_change gets its own copy as the tab rounds it in place
+    df['percent_change'] = np.array(bars[first_row:, 4])
+    return df
+
+
+# Tab 🔎 Search for Stocks
+# Function that aligns the daily closes of several symbols on the dates all of them traded, within the last days
+# given. The local stores of every symbol are synced together with one query and then read from disk.
+@instrument
+def get_comparison_closes(tickers, period_days):
+    tickers = list(dict.fromkeys(ticker.upper() for ticker in tickers))
+    sync_ohlc_stores(tuple(sorted(tickers)))
+    first_day = np.datetime64("today", "D") - np.timedelta64(period_days, "D")
+    closes = {}
+    for ticker in tickers:
+        dates, bars = read_store_arrays(ticker, "day")
+        if dates is not None and len(dates):
+            first_row = np.searchsorted(dates, first_day, side="right")
+            closes[ticker] = pd.Series(bars[first_row:, 3], index=pd.to_datetime(dates[first_row:]))
+    if not closes:
+        return pd.DataFrame()
+    return pd.concat(closes, axis=1, join="inner")
+
+
+# Tab 🔎 Search for Stocks
+# Function to summarize the returns of every symbol compared, over the same dates
+def comparison_returns(closes):
+    daily_returns = closes.pct_change().iloc[1:]
+    return pd.DataFrame({"Return": closes.iloc[-1] / closes.iloc[0] - 1,
+                         "Annualized volatility": daily_returns.std() * np.sqrt(252),
+                         "Max drawdown": (closes / closes.cummax() - 1).min(),
+                         "Best day": daily_returns.max(),
+                         "Worst day": daily_returns.min()})
+
+
+# Tab 🔎 Search for Stocks
+# Function to merge adjacent candles when there are more of them than fit in the chart. Every group of candles is
+# drawn as a single candle with the first open, highest high, lowest low and last close of the group, so the
+# extremes of the price are never lost. Returns the candles to draw and how many bars went into each of them.
+@instrument
+def decimate_ohlc(df, max_points):
+    row_count = len(df.index)
+    max_points = max(int(max_points), 1)
+    if row_count <= max_points:
+        return df, 1
+    group_size = -(-row_count // max_points)
+    starts = np.arange(0, row_count, group_size)
+    ends = np.minimum(starts + group_size, row_count) - 1
+    decimated_df = pd.DataFrame({'date': df['date'].values[starts],
+                                 'open': df['open'].values[starts],
+                                 'high': np.maximum.reduceat(df['high'].values, starts),
+                                 'low': np.minimum.reduceat(df['low'].values, starts),
+                                 'close': df['close'].values[ends]})
+    return decimated_df, group_size
+
+
+# Tab 🔎 Search for Stocks
+# Function to pick the value of an indicator for every candle drawn, the value at the last bar of each group of bars
+# merged into one candle by decimate_ohlc
+def decimate_last(values, group_size):
+    if group_size == 1:
+        return values
+    ends = np.minimum(np.arange(group_size, len(values) + group_size, group_size), len(values)) - 1
+    return values[ends]
+
+
+# Tab 🔎 Search for Stocks
+# Building blocks of the indicators. Rolling windows are computed for the new bars only, with the bars of the window
+# before them as context, and exponential averages (pandas ewm with adjust=False) continue from the last value
+# computed, so extending an indicator never goes over the whole history again.
+def rolling_from(values, start, period, statistic):
+    context = max(start - period + 1, 0)
+    rolled = getattr(pd.Series(values[context:]).rolling(period), statistic)()
+    return rolled.to_numpy()[start - context:]
+
+
+def ewm_from(values, alpha, seed=np.nan):
+    if np.isnan(seed):
+        return pd.Series(values).ewm(alpha=alpha, adjust=False).mean().to_numpy()
+    return pd.Series(np.concatenate(([seed], values))).ewm(alpha=alpha, adjust=False).mean().to_numpy()[1:]
+
+
+def last_value(previous, column, start):
+    return previous[column][start - 1] if start and column in previous else np.nan
+
+
+# Tab 🔎 Search for Stocks
+# Technical indicators. Every indicator receives the bars of the symbol, the first bar to compute and the columns
+# already computed before it, and returns its columns from that bar onwards. Columns starting with _ are the state
+# kept to continue the indicator and are not drawn.
+def indicator_sma(bars, start, previous, period):
+    return {f"SMA {period}": rolling_from(bars["close"], start, period, "mean")}
+
+
+def indicator_ema(bars, start, previous, period):
+    return {f"EMA {period}": ewm_from(bars["close"][start:], 2 / (period + 1),
+                                      last_value(previous, f"EMA {period}", start))}
+
+
+def indicator_bollinger(bars, start, previous, period, width):
+    middle = rolling_from(bars["close"], start, period, "mean")
+    spread = width * rolling_from(bars["close"], start, period, "std")
+    return {"Bollinger middle": middle, "Bollinger upper": middle + spread, "Bollinger lower": middle - spread}
+
+
+def indicator_rsi(bars, start, previous, period):
+    changes = np.diff(bars["close"][max(start - 1, 0):])
+    if start == 0:
+        changes = np.concatenate(([np.nan], changes))
+    average_gain = ewm_from(np.clip(changes, 0, None), 1 / period, last_value(previous, "_gain", start))
+    average_loss = ewm_from(np.clip(-changes, 0, None), 1 / period, last_value(previous, "_loss", start))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        rsi = 100 - 100 / (1 + average_gain / average_loss)
+    return {f"RSI {period}": rsi, "_gain": average_gain, "_loss": average_loss}
+
+
+def indicator_macd(bars, start, previous, fast, slow, signal):
+    fast_ema = ewm_from(bars["close"][start:], 2 / (fast + 1), last_value(previous, "_fast", start))
+    slow_ema = ewm_from(bars["close"][start:], 2 / (slow + 1), last_value(previous, "_slow", start))
+    macd = fast_ema - slow_ema
+    signal_line = ewm_from(macd, 2 / (signal + 1), last_value(previous, "MACD signal", start))
+    return {"MACD": macd, "MACD signal": signal_line, "MACD histogram": macd - signal_line,
+            "_fast": fast_ema, "_slow": slow_ema}
+
+
+def indicator_atr(bars, start, previous, period):
+    previous_close = bars["close"][max(start - 1, 0):-1]
+    if start == 0:
+        previous_close = np.concatenate(([np.nan], previous_close))
+    true_range = np.fmax(bars["high"][start:] - bars["low"][start:],
+                         np.fmax(np.abs(bars["high"][start:] - previous_close),
+                                 np.abs(bars["low"][start:] - previous_close)))
+    return {f"ATR {period}": ewm_from(true_range, 1 / period, last_value(previous, f"ATR {period}", start))}
+
+
+def indicator_volatility(bars, start, previous, period):
+    context = max(start - period, 0)
+    log_returns = np.diff(np.log(bars["close"][context:]))
+    if start == 0:
+        log_returns = np.concatenate(([np.nan], log_returns))
+    volatility = pd.Series(log_returns).rolling(period).std().to_numpy()
+    if start:
+        volatility = volatility[start - context - 1:]
+    return {f"Volatility {period}": volatility * np.sqrt(PERIODS_PER_YEAR[bars["timeframe"]])}
+
+
+# Indicators offered on the chart, with their parameters and whether they are drawn over the candles or below them
+INDICATORS = {"SMA": {"compute": indicator_sma, "params": {"period": 20}, "subplot": False},
+              "EMA": {"compute": indicator_ema, "params": {"period": 20}, "subplot": False},
+              "Bollinger Bands": {"compute": indicator_bollinger, "params": {"period": 20, "width": 2.0},
+                                  "subplot": False},
+              "RSI": {"compute": indicator_rsi, "params": {"period": 14}, "subplot": True},
+              "MACD": {"compute": indicator_macd, "params": {"fast": 12, "slow": 26, "signal": 9}, "subplot": True},
+              "ATR": {"compute": indicator_atr, "params": {"period": 14}, "subplot": True},
+              "Volatility": {"compute": indicator_volatility, "params": {"period": 20}, "subplot": True}}
+
+
+# Tab 🔎 Search for Stocks
+# Indicators computed so far for every (symbol, timescale, indicator, parameters), shared by every session. The
+# least recently used ones are dropped past INDICATOR_CACHE_ENTRIES.
+@st.experimental_singleton
+def get_indicator_cache():
+    return {"lock": threading.Lock(), "entries": {}}
+
+
+# Tab 🔎 Search for Stocks
+# Function that returns an indicator over the whole history of a symbol at a timescale. When the indicator was
+# computed before, every bar but the last one (a period that may still have been open) is kept and only the bars
+# from there onwards are computed, continuing from the state of the indicator at that point.
+@instrument
+def get_indicator(ticker, timeframe, indicator_name, params):
+    ticker = ticker.upper()
+    if timeframe == 'Day':
+        sync_ohlc_store(ticker)
+    else:
+        refresh_ohlc_pyramid(ticker, sync_ohlc_store(ticker))
+    dates, ohlc = read_store_arrays(ticker, timeframe.lower())
+    if dates is None or len(dates) == 0:
+        return pd.DataFrame()
+
+    cache = get_indicator_cache()
+    cache_key = (ticker, timeframe, indicator_name, params)
+    with cache["lock"]:
+        cached = cache["entries"].pop(cache_key, None)
+    start, previous = 0, {}
+    if cached is not None:
+        kept = min(len(cached["dates"]) - 1, len(dates))
+        if kept > 0 and cached["dates"][0] == dates[0] and cached["dates"][kept - 1] == dates[kept - 1]:
+            start, previous = kept, cached["columns"]
+
+    bars = {column: ohlc[:, position] for position, column in enumerate(OHLC_STORE_COLUMNS)}
+    bars["timeframe"] = timeframe
+    new_columns = INDICATORS[indicator_name]["compute"](bars, start, previous, *params)
+    columns = {name: np.concatenate((previous[name][:start], values)) if start else values
+               for name, values in new_columns.items()}
+    with cache["lock"]:
+        cache["entries"][cache_key] = {"dates": np.array(dates), "columns": columns}
+        while len(cache["entries"]) > INDICATOR_CACHE_ENTRIES:
+            cache["entries"].pop(next(iter(cache["entries"])))
+    return pd.DataFrame({name: values for name, values in columns.items() if not name.startswith("_")},
+                        index=pd.to_datetime(dates))
+
+
+# Tab 🔎 Search for Stocks
+# Function that bins the percent of change with NumPy and computes the statistics of its distribution. Bins are
+# aligned to multiples of the bin width, so the distributions of different stocks line up on the same bins.
+def percent_change_distribution(percent_change, threshold, bin_width=HISTOGRAM_BIN_WIDTH):
+    values = np.asarray(percent_change, dtype=np.float64)
+    values = values[np.isfinite(values)]
+    if len(values) == 0:
+        return {"bin_start": np.empty(0), "probability": np.empty(0), "stats": {}}
+
+    bin_index = np.floor(values / bin_width).astype(np.int64)
+    first_bin = bin_index.min()
+    probability = np.bincount(bin_index - first_bin) / len(values)
+    bin_start = (first_bin + np.arange(len(probability))) * bin_width
+
+    mean, volatility = values.mean(), values.std()
+    stats = {"Samples": len(values),
+             "Mean": mean,
+             "Volatility": volatility,
+             "Skew": float(np.mean(((values - mean) / volatility) ** 3)) if volatility > 0 else 0.0,
+             f"P(> +{threshold:.1%})": float(np.mean(values > threshold)),
+             f"P(< -{threshold:.1%})": float(np.mean(values < -threshold))}
+    for quantile, quantile_value in zip(DISTRIBUTION_QUANTILES, np.quantile(values, DISTRIBUTION_QUANTILES)):
+        stats[f"Q{quantile:.0%}"] = quantile_value
+    return {"bin_start": bin_start, "probability": probability, "stats": stats}
+
+
+# Tab 🔎 Search for Stocks
+# Distribution of the percent of change of a stock over its last bars, cached per symbol, timescale and range.
+# The watermark of the local store is part of the key so new bars invalidate the cache.
+@instrumented_memo(max_entries=1024, show_spinner=True)
+def get_percent_change_distribution(ticker, timeframe, bar_count, threshold, watermark):
+    df = get_search_bars(ticker, timeframe).tail(bar_count)
+    return percent_change_distribution(df['percent_change'].values, threshold)
+
+
+# Tab 🔎 Search for Stocks
+# Function that yields the bars of a symbol in chunks of EXPORT_CHUNK_ROWS rows. The bars come from the memory-mapped
+# store, so only the chunk being written is loaded in memory. A symbol without bars still yields one empty chunk, so
+# its file gets the header or schema of the columns.
+def iter_export_chunks(ticker, timeframe, bar_count=None):
+    df = get_search_bars(ticker, timeframe)
+    if bar_count:
+        df = df.tail(bar_count)
+    for start in range(0, max(len(df.index), 1), EXPORT_CHUNK_ROWS):
+        yield df.iloc[start:start + EXPORT_CHUNK_ROWS].assign(symbol=ticker)
+
+
+# Tab 🔎 Search for Stocks
+# Function that writes chunks of bars to a binary file in the export format, one chunk at a time. pyarrow is only
+# imported for the Parquet and Arrow formats.
+def write_export(chunks, export_format, output):
+    if export_format == "CSV":
+        for chunk_number, chunk in enumerate(chunks):
+            output.write(chunk.to_csv(index=False, header=chunk_number == 0).encode('utf-8'))
+        return
+
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    writer = None
+    for chunk in chunks:
+        table = pa.Table.from_pandas(chunk, preserve_index=False)
+        if writer is None:
+            writer = (pq.ParquetWriter(output, table.schema) if export_format == "Parquet"
+                      else pa.ipc.new_file(output, table.schema))
+        writer.write_table(table)
+    if writer is not None:
+        writer.close()
+
+
+# Tab 🔎 Search for Stocks
+# Function to build the export file of one or more symbols and return its path. Several symbols are packed into a zip
+# archive one symbol at a time, so memory stays the same no matter how many symbols or years are exported. Files are
+# named after the request and the watermark of every symbol, so an export is only built again when there is new data.
+@instrument
+def build_export(tickers, timeframe, export_format, bar_count=None):
+    tickers = [ticker.upper() for ticker in tickers]
+    watermarks = [sync_ohlc_store(ticker) for ticker in tickers]
+    export_key = hashlib.sha1(repr((tickers, timeframe, export_format, bar_count, watermarks)).encode()).hexdigest()
+    extension = EXPORT_FORMATS[export_format][0]
+    export_path = os.path.join(EXPORT_DIR, f"{export_key[:20]}.{'zip' if len(tickers) > 1 else extension}")
+    if os.path.exists(export_path):
+        return export_path
+
+    os.makedirs(EXPORT_DIR, exist_ok=True)
+    temporary_path = f"{export_path}.{threading.get_ident()}.tmp"
+    if len(tickers) == 1:
+        with open(temporary_path, "wb") as output:
+            write_export(iter_export_chunks(tickers[0], timeframe, bar_count), export_format, output)
+    else:
+        with zipfile.ZipFile(temporary_path, "w", compression=zipfile.ZIP_DEFLATED, allowZip64=True) as archive:
+            for ticker in tickers:
+                symbol_path = f"{temporary_path}.{ticker}"
+                with open(symbol_path, "wb") as output:
+                    write_export(iter_export_chunks(ticker, timeframe, bar_count), export_format, output)
+                archive.write(symbol_path, arcname=f"{ticker}.{extension}")
+                os.remove(symbol_path)
+    os.replace(temporary_path, export_path)
+
+    for export_file in os.listdir(EXPORT_DIR):
+        file_path = os.path.join(EXPORT_DIR, export_file)
+        try:
+            if time.time() - os.path.getmtime(file_path) > EXPORT_MAX_AGE_HOURS * 3600:
+                os.remove(file_path)
+        except OSError:
+            pass
+    return export_path
+
+
+# Nightly job
+# Function that creates the indexes of DATABASE_INDEXES, run by nightly_refresh.py instead of on a page view.
+# CREATE INDEX CONCURRENTLY keeps the tables writable while an index is built but can't run inside a transaction, so
+# it gets its own connection in autocommit mode, without the statement timeout. An index left invalid by a build that
+# was interrupted is dropped and built again.
+def create_database_indexes():
+    connection = psycopg2.connect(**st.secrets["wbets"])
+    connection.autocommit = True
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute("SET statement_timeout = 0")
+            for index_name, index_definition in DATABASE_INDEXES.items():
+                cursor.execute("SELECT indisvalid FROM pg_index WHERE indexrelid = to_regclass(%s)", (index_name,))
+                index_state = cursor.fetchone()
+                if index_state is not None and not index_state[0]:
+                    cursor.execute(f"DROP INDEX CONCURRENTLY {index_name}")
+                cursor.execute(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {index_name} ON {index_definition}")
+    finally:
+        connection.close()
+    return list(DATABASE_INDEXES)
+
+
+# Nightly job
+# Function that refreshes the breakout signals and the mention rollup, then the local store, the pyramid, the screener
+# matrix and the company profile of every symbol in data_stocks_daily. It is run by nightly_refresh.py once the daily
+# bars are loaded.
+def refresh_all_symbols():
+    refresh_breakout_signals()
+    refresh_mention_rollup()
+    symbols = get_symbol_stats()['symbol'].str.upper().tolist()
+    watermarks = {}
+    for batch_start in range(0, len(symbols), STORE_SYNC_BATCH):
+        watermarks.update(fetch_into_stores(symbols[batch_start:batch_start + STORE_SYNC_BATCH]))
+
+    def refresh_symbol(ticker):
+        return refresh_ohlc_pyramid(ticker, watermarks[ticker])
+
+    with ThreadPoolExecutor(max_workers=DB_POOL_MAX_CONNECTIONS) as executor:
+        list(executor.map(refresh_symbol, symbols))
+    sync_screener_matrix()
+    for prefetch in prefetch_company_profiles(symbols):
+        prefetch.result()
+    return len(symbols)
 
 
 # Tab 🚀 Wallstreetbets
-# Function to fetch a query with the count of mentions for each stock, grouped by stock
-@st.experimental_memo(ttl=86400, show_spinner=True)
+# Function that keeps mention_daily_counts, the number of mentions of every stock per day, up to date. Only the
+# mentions with an id above the last one rolled up (mention_rollup_watermark) are counted and added to their day. The
+# first build counts the whole mention table, so the statement timeout is lifted for this transaction.
+@instrumented_memo(ttl=600, show_spinner=True)
+@retry_on_disconnect
+def refresh_mention_rollup():
+    with db_cursor() as cursor:
+        cursor.execute("SELECT pg_advisory_xact_lock(hashtext('mention_daily_counts'))")
+        cursor.execute("SET LOCAL statement_timeout = 0")
+        cursor.execute("""
+                CREATE TABLE IF NOT EXISTS mention_daily_counts (
+                    stock_id BIGINT NOT NULL,
+                    day DATE NOT NULL,
+                    num_mentions BIGINT NOT NULL,
+                    last_dt TIMESTAMP,
+                    PRIMARY KEY (stock_id, day));
+                CREATE INDEX IF NOT EXISTS mention_daily_counts_day_idx ON mention_daily_counts (day);
+                CREATE TABLE IF NOT EXISTS mention_rollup_watermark (
+                    id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+                    last_mention_id BIGINT NOT NULL);
+                INSERT INTO mention_rollup_watermark (last_mention_id) VALUES (0) ON CONFLICT DO NOTHING;
+                """)
+        cursor.execute("SELECT last_mention_id FROM mention_rollup_watermark")
+        from_id = cursor.fetchone()[0]
+        cursor.execute("SELECT COALESCE(MAX(id), 0) FROM mention")
+        to_id = cursor.fetchone()[0]
+        if to_id <= from_id:
+            return 0
+
+        cursor.execute("""
+                INSERT INTO mention_daily_counts (stock_id, day, num_mentions, last_dt)
+                SELECT stock_id, date(dt), COUNT(*), MAX(dt)
+                FROM mention
+                WHERE id > %s AND id <= %s
+                GROUP BY stock_id, date(dt)
+                ON CONFLICT (stock_id, day) DO UPDATE
+                SET num_mentions = mention_daily_counts.num_mentions + EXCLUDED.num_mentions,
+                last_dt = GREATEST(mention_daily_counts.last_dt, EXCLUDED.last_dt)""", (from_id, to_id))
+        cursor.execute("UPDATE mention_rollup_watermark SET last_mention_id = %s", (to_id,))
+    return to_id - from_id
+
+
+# Tab 🚀 Wallstreetbets
+# Function to fetch the daily mention counts of every stock for the last days of the rollup, at most one row per
+# stock and day. It is read once and serves every position of the Number of days slider.
+@instrumented_memo(ttl=600, show_spinner=True)
+@retry_on_disconnect
+def get_mention_rollup(max_days):
+    refresh_mention_rollup()
+    rollup = copy_query_frame("""
+                SELECT day, stock_id, symbol, name, num_mentions, last_dt AS dt
+                FROM mention_daily_counts JOIN stock ON stock.id = mention_daily_counts.stock_id
+                WHERE day > (SELECT MAX(day) FROM mention_daily_counts) - %s
+                """, (max_days,), dtype={"stock_id": np.int64, "num_mentions": np.int64}, parse_dates=["day", "dt"])
+    return rollup
+
+
+# Tab 🚀 Wallstreetbets
+# Function with the count of mentions for each stock in the last days, grouped by stock. The counts are a sum of
+# the daily rollup, so any number of days up to 30 is answered without going back to the mention table.
+@instrumented_memo(ttl=600, show_spinner=True)
 def get_data_wsbt(num_of_days):
-    cursor.execute("""
-                    SELECT COUNT(*) AS num_mentions, symbol, name, MAX(dt) AS dt
+    rollup = get_mention_rollup(30)
+    if rollup.empty:
+        return []
+    rollup = rollup[rollup['day'] > rollup['day'].max() - datetime.timedelta(days=num_of_days)]
+    counts = rollup.groupby(['stock_id', 'symbol', 'name'], as_index=False).agg(num_mentions=('num_mentions', 'sum'),
+                                                                                   dt=('dt', 'max'))
+    counts = counts.sort_values('num_mentions', ascending=False)
+    return counts[['num_mentions', 'symbol', 'name', 'dt']].to_dict('records')
+
+
+# Tab 🚀 Wallstreetbets
+# Function to search the mentions with a web search style query (words, "quoted phrases", -excluded words, or),
+# optionally filtered by symbol and date range. The matches come from the GIN index on MENTION_SEARCH_VECTOR built by
+# the nightly job. Only the most recent MENTION_SEARCH_CANDIDATES matches are ranked by relevance and paginated by
+# offset, so a common word never ranks or counts the whole table. Returns the page and the number of matches, which
+# stops at MENTION_SEARCH_CANDIDATES.
+@instrumented_memo(ttl=600, show_spinner=True)
+@retry_on_disconnect
+def search_mentions(search_text, symbol=None, start_date=None, end_date=None, offset=0,
+                    page_size=MENTIONS_PAGE_SIZE):
+    conditions, params = [f"({MENTION_SEARCH_VECTOR}) @@ query"], [search_text]
+    if symbol:
+        conditions.append("stock.symbol = %s")
+        params.append(symbol)
+    if start_date:
+        conditions.append("mention.dt >= %s::date")
+        params.append(start_date)
+    if end_date:
+        conditions.append("mention.dt < %s::date + 1")
+        params.append(end_date)
+
+    with db_cursor() as cursor:
+        cursor.execute(f"""
+                WITH candidates AS (
+                    SELECT mention.id, symbol, message, url, dt, author, query
+                    FROM websearch_to_tsquery('english', %s) AS query,
+                         mention JOIN stock ON stock.id = mention.stock_id
+                    WHERE {' AND '.join(conditions)}
+                    ORDER BY mention.dt DESC, mention.id DESC
+                    LIMIT %s
+                )
+                SELECT id, symbol, message, url, dt, author, ts_rank({MENTION_SEARCH_VECTOR}, query) AS rank,
+                       COUNT(*) OVER () AS match_count
+                FROM candidates
+                ORDER BY rank DESC, dt DESC, id DESC
+                LIMIT %s OFFSET %s""", params + [MENTION_SEARCH_CANDIDATES, page_size, offset])
+        search_page = [dict(row) for row in cursor.fetchall()]
+    return search_page, search_page[0]['match_count'] if search_page else 0
+
+
+# Tab 🚀 Wallstreetbets
+# Function to fetch one page of mentions, newest first, optionally filtered by symbol and date range. Pages are
+# paginated by keyset: the next page starts right after the (dt, id) of the last mention of the previous page, so
+# every page is a range scan of the mention (dt, id) indexes no matter how deep the user goes. The indexes are built
+# by the nightly job (DATABASE_INDEXES).
+@instrumented_memo(ttl=600, show_spinner=True)
+@retry_on_disconnect
+def get_mentions_page(symbol=None, start_date=None, end_date=None, after_dt=None, after_id=None,
+                      page_size=MENTIONS_PAGE_SIZE):
+    conditions, params = [], []
+    if symbol:
+        conditions.append("stock.symbol = %s")
+        params.append(symbol)
+    if start_date:
+        conditions.append("mention.dt >= %s::date")
+        params.append(start_date)
+    if end_date:
+        conditions.append("mention.dt < %s::date + 1")
+        params.append(end_date)
+    if after_dt is not None:
+        conditions.append("(mention.dt, mention.id) < (%s, %s)")
+        params.extend([after_dt, after_id])
+    where_clause = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+    with db_cursor() as cursor:
+        cursor.execute(f"""
+                SELECT mention.id, symbol, message, url, dt, author
+                FROM mention JOIN stock ON stock.id = mention.stock_id
+                {where_clause}
+                ORDER BY mention.dt DESC, mention.id DESC
+                LIMIT %s""", params + [page_size])
+        mentions_page = [dict(row) for row in cursor.fetchall()]
+    return mentions_page
+
+
+# Tab 🚀 Wallstreetbets
+# Function to turn a date or datetime into microseconds since epoch, the same value the mention index keeps for dt
+def to_epoch_microseconds(value):
+    if not isinstance(value, datetime.datetime):
+        value = datetime.datetime.combine(value, datetime.time())
+    return calendar.timegm(value.utctimetuple()) * 1000000 + value.microsecond
+
+
+# Tab 🚀 Wallstreetbets
+# In-memory index of the mentions shared by every session. Every symbol maps to the dt (in microseconds) and id of
+# its mentions as NumPy arrays sorted by time, so a symbol's mentions and counts are found without going through
+# the mentions of the other symbols. The messages themselves stay in the database.
+@st.experimental_singleton
+def get_mention_index():
+    return {"lock": threading.Lock(), "symbols": {}, "last_id": 0, "refreshed_at": None}
+
+
+# Tab 🚀 Wallstreetbets
+# Function that adds the mentions that arrived since the last refresh to the index. Only the mentions with an id
+# above the last one indexed are fetched, and only the symbols that received new mentions are sorted again. The
+# mentions are streamed from a server-side cursor and turned into arrays one batch at a time, so the first build never
+# holds the rows of the whole table.
+@instrument
+@retry_on_disconnect
+def refresh_mention_index(force=False):
+    mention_index = get_mention_index()
+    with mention_index["lock"]:
+        refreshed_at = mention_index["refreshed_at"]
+        if not force and refreshed_at is not None and time.monotonic() - refreshed_at < MENTION_INDEX_REFRESH_SECONDS:
+            return mention_index
+        rows = stream_rows("""
+                    SELECT symbol, (EXTRACT(EPOCH FROM dt) * 1000000)::bigint AS dt, mention.id
                     FROM mention JOIN stock ON stock.id = mention.stock_id
-                    WHERE date(dt) > (SELECT MAX(date(dt)) FROM mention) - interval '%s day'
-                    GROUP BY stock_id, symbol, name         
-                    ORDER BY num_mentions DESC
-                    """, (num_of_days,))
-    columns = [col[0] for col in cursor.description]
-    rows = [dict(zip(columns, row)) for row in cursor.fetchall()]
-    return rows
+                    WHERE mention.id > %s
+                    ORDER BY symbol, dt, mention.id""", (mention_index["last_id"],))
+
+        # The arrays of every batch are split by symbol, a symbol's mentions can come in several batches
+        new_mentions, last_id = {}, mention_index["last_id"]
+        for batch in iter(lambda: list(itertools.islice(rows, DB_STREAM_ITERSIZE)), []):
+            symbol_column = np.array([row[0] for row in batch], dtype=object)
+            dt_column = np.fromiter((row[1] for row in batch), dtype=np.int64, count=len(batch))
+            id_column = np.fromiter((row[2] for row in batch), dtype=np.int64, count=len(batch))
+            boundaries = np.flatnonzero(symbol_column[1:] != symbol_column[:-1]) + 1
+            for start, end in zip(np.concatenate(([0], boundaries)), np.concatenate((boundaries, [len(batch)]))):
+                new_mentions.setdefault(symbol_column[start], []).append((dt_column[start:end], id_column[start:end]))
+            last_id = max(last_id, int(id_column.max()))
+
+        for symbol, batches in new_mentions.items():
+            new_dts = np.concatenate([batch_dts for batch_dts, _ in batches])
+            new_ids = np.concatenate([batch_ids for _, batch_ids in batches])
+            if symbol in mention_index["symbols"]:
+                old_dts, old_ids = mention_index["symbols"][symbol]
+                first_new_dt = new_dts[0]
+                new_dts, new_ids = np.concatenate((old_dts, new_dts)), np.concatenate((old_ids, new_ids))
+                if old_dts[-1] > first_new_dt:
+                    order = np.lexsort((new_ids, new_dts))
+                    new_dts, new_ids = new_dts[order], new_ids[order]
+            mention_index["symbols"][symbol] = (new_dts, new_ids)
+        mention_index["last_id"] = last_id
+        mention_index["refreshed_at"] = time.monotonic()
+    return mention_index
 
 
 # Tab 🚀 Wallstreetbets
-# Function to fetch a query with all the data within the mentions query, sorted by the date field
-@st.experimental_memo(ttl=86400, show_spinner=True)
-def get_dict_wsb():
-    cursor.execute("""
-                SELECT symbol, message, url, dt, author
+# Function that answers "latest N mentions for a symbol since a date" from the index. before is the (dt, id) key the
+# page has to start after, the same key used by the keyset pagination of get_mentions_page. Returns the ids of the
+# mentions, newest first, and the number of mentions indexed for the symbol.
+@instrument
+def latest_mention_ids(symbol, count, since=None, before=None):
+    dts, ids = refresh_mention_index()["symbols"].get(symbol, (np.empty(0, np.int64), np.empty(0, np.int64)))
+    first = np.searchsorted(dts, to_epoch_microseconds(since), side="left") if since else 0
+    last = len(dts)
+    if before is not None:
+        before_dt, before_id = to_epoch_microseconds(before[0]), before[1]
+        last = np.searchsorted(dts, before_dt, side="left")
+        same_dt_end = np.searchsorted(dts, before_dt, side="right")
+        last += np.searchsorted(ids[last:same_dt_end], before_id, side="left")
+    return ids[max(first, last - count):last][::-1].tolist(), len(dts)
+
+
+# Tab 🚀 Wallstreetbets
+# Function to fetch the mentions with the given ids, newest first
+@instrumented_memo(ttl=600, show_spinner=True)
+@retry_on_disconnect
+def get_mentions_by_id(mention_ids):
+    if not mention_ids:
+        return []
+    with db_cursor() as cursor:
+        cursor.execute("""
+                SELECT mention.id, symbol, message, url, dt, author
                 FROM mention JOIN stock ON stock.id = mention.stock_id
-                ORDER BY dt DESC
-            """)
-    mentions_data_dict = cursor.fetchall()
-    return mentions_data_dict
+                WHERE mention.id = ANY(%s)
+                ORDER BY mention.dt DESC, mention.id DESC""", (list(mention_ids),))
+        mentions_found = [dict(row) for row in cursor.fetchall()]
+    return mentions_found
 
 
-mentions = get_dict_wsb()
+# Tab 🚀 Wallstreetbets
+# Function to fetch one page of the mentions of a symbol through the mention index, with the same arguments as
+# get_mentions_page. Returns the page and the number of mentions of the symbol.
+@instrument
+def get_symbol_mentions_page(symbol, start_date=None, end_date=None, after_dt=None, after_id=None,
+                             page_size=MENTIONS_PAGE_SIZE):
+    before = (after_dt, after_id) if after_dt is not None else None
+    if before is None and end_date:
+        before = (end_date + datetime.timedelta(days=1), -1)
+    mention_ids, symbol_mention_count = latest_mention_ids(symbol, page_size, since=start_date, before=before)
+    return get_mentions_by_id(tuple(mention_ids)), symbol_mention_count
 
 
 # Tab 📈 Trending
-# Function that runs through the historical data and selects stocks based on a calculations known as a breakout trend.
-@st.experimental_memo(show_spinner=True)
+# Function that keeps the breakout_signals table up to date with the stocks matching the breakout pattern.
+# Every symbol of breakout_signals_watermark reads, with a range scan of the (symbol, date) index, only the bars after
+# the last date already processed plus that last bar, so LAG has a previous candle to compare with. The symbols not
+# tracked yet are found with the index skip scan of PRICE_SYMBOLS_CTE and read from their first bar. The first build
+# goes over the whole history, so the statement timeout is lifted for this transaction, and the advisory lock keeps
+# two sessions from refreshing at once.
+@instrumented_memo(ttl=3600, show_spinner=True)
+@retry_on_disconnect
+def refresh_breakout_signals():
+    with db_cursor() as cursor:
+        cursor.execute("SELECT pg_advisory_xact_lock(hashtext('breakout_signals'))")
+        cursor.execute("SET LOCAL statement_timeout = 0")
+        cursor.execute("""
+                CREATE TABLE IF NOT EXISTS breakout_signals (
+                    symbol TEXT NOT NULL,
+                    date DATE NOT NULL,
+                    open NUMERIC,
+                    close NUMERIC,
+                    previous_open NUMERIC,
+                    previous_close NUMERIC,
+                    PRIMARY KEY (symbol, date));
+                CREATE INDEX IF NOT EXISTS breakout_signals_date_idx ON breakout_signals (date);
+                CREATE TABLE IF NOT EXISTS breakout_signals_watermark (
+                    symbol TEXT PRIMARY KEY,
+                    last_date DATE NOT NULL);
+                """)
+        cursor.execute(f"""
+                WITH RECURSIVE {PRICE_SYMBOLS_CTE}, tracked_symbols AS (
+                    SELECT symbol, last_date FROM breakout_signals_watermark
+                    UNION ALL
+                    SELECT symbol, NULL::date FROM price_symbols
+                    WHERE symbol IS NOT NULL
+                    AND NOT EXISTS (SELECT 1 FROM breakout_signals_watermark w WHERE w.symbol = price_symbols.symbol)
+                ), new_bars AS (
+                    SELECT t.symbol, t.last_date, b.date, b.open, b.close, b.previous_open, b.previous_close
+                    FROM tracked_symbols t
+                    CROSS JOIN LATERAL (
+                        SELECT date(d.date) AS date, d.open, d.close,
+                        LAG(d.close, 1) OVER (ORDER BY d.date) AS previous_close,
+                        LAG(d.open, 1) OVER (ORDER BY d.date) AS previous_open
+                        FROM data_stocks_daily d
+                        WHERE d.symbol = t.symbol AND d.date >= COALESCE(t.last_date, '-infinity'::date)
+                    ) b
+                ), watermark AS (
+                    INSERT INTO breakout_signals_watermark (symbol, last_date)
+                    SELECT symbol, MAX(date) FROM new_bars
+                    GROUP BY symbol
+                    HAVING MAX(date) > COALESCE(MAX(last_date), '-infinity'::date)
+                    ON CONFLICT (symbol) DO UPDATE SET last_date = EXCLUDED.last_date
+                )
+                INSERT INTO breakout_signals (symbol, date, open, close, previous_open, previous_close)
+                SELECT symbol, date, open, close, previous_open, previous_close
+                FROM new_bars
+                WHERE (last_date IS NULL OR date > last_date)
+                AND previous_close < previous_open AND close > previous_open
+                AND open < previous_close
+                ON CONFLICT (symbol, date) DO NOTHING
+                """)
+        new_signals = cursor.rowcount
+    return new_signals
+
+
+# Tab 📈 Trending
+# Function that selects the stocks that matched the breakout trend (a bullish engulfing) in the last days, read from
+# the breakout_signals table with a range query on its date index instead of running the window over the whole price
+# history.
+@instrumented_memo(ttl=3600, show_spinner=True)
+@retry_on_disconnect
 def get_trending_stock(trending_num_days):
-    cursor.execute(f""" SELECT * FROM ( SELECT date, open, close, symbol, lAG(close, 1) OVER ( ORDER BY date) 
-    previous_close, LAG(open, 1) OVER ( ORDER BY date) previous_open FROM data_stocks_daily ) a 
-    WHERE date(date) > (SELECT MAX(date(date)) FROM data_stocks_daily) - interval '%s day' 
-    AND previous_close < previous_open AND close > previous_open 
-    AND open < previous_close""", (trending_num_days,))
-    rows_engulfing = cursor.fetchall()
+    refresh_breakout_signals()
+    with db_cursor() as cursor:
+        cursor.execute("""
+                SELECT date, open, close, symbol, previous_close, previous_open
+                FROM breakout_signals
+                WHERE date > (SELECT MAX(last_date) FROM breakout_signals_watermark) - interval '%s day'
+                ORDER BY date DESC, symbol""", (trending_num_days,))
+        rows_engulfing = [dict(row) for row in cursor.fetchall()]
     return rows_engulfing
 
 
-# Tab 🔎 Search for Stocks
-# Convert Dataframe to csv for users to be able to download
-@st.experimental_memo(show_spinner=True)
-def convert_df(data_set_for_download):
-    # IMPORTANT: Cache the conversion to prevent computation on every rerun
-    return data_set_for_download.to_csv().encode('utf-8')
+# Tab 📈 Trending
+# Function that loads the OHLC of every symbol for the pattern scanner into contiguous NumPy arrays, sorted by
+# symbol and then by date. The bars of symbols[i] are the slice offsets[i]:offsets[i + 1] of every array. The last
+# day of the market comes from symbol_stats.
+@instrumented_memo(ttl=3600, show_spinner=True)
+@retry_on_disconnect
+def get_ohlc_universe(history_days):
+    refresh_symbol_stats()
+    universe = copy_query_frame("""
+            SELECT symbol, date(date) AS date, open, high, low, close
+            FROM data_stocks_daily
+            WHERE date > (SELECT MAX(last_date) FROM symbol_stats) - interval '%s day'
+            ORDER BY symbol, date""", (history_days,), dtype=OHLC_COPY_DTYPES, parse_dates=["date"])
+
+    symbol_codes = universe["symbol"].cat.codes.to_numpy()
+    offsets = np.flatnonzero(symbol_codes[1:] != symbol_codes[:-1]) + 1
+    offsets = np.concatenate(([0], offsets, [len(symbol_codes)]) if len(symbol_codes) else ([0],)).astype(np.int64)
+    return {"symbols": universe["symbol"].to_numpy(dtype=object)[offsets[:-1]],
+            "offsets": offsets,
+            "date": universe["date"].to_numpy(dtype="datetime64[D]"),
+            "open": universe["open"].to_numpy(),
+            "high": universe["high"].to_numpy(),
+            "low": universe["low"].to_numpy(),
+            "close": universe["close"].to_numpy()}
+
+
+# Tab 📈 Trending
+# Candlestick patterns for the scanner. Every pattern receives the arrays of the whole universe together with the
+# previous candle of each bar (already shifted within each symbol) and returns a boolean mask with the matches.
+def pattern_bearish_engulfing(bars, breakout_days):
+    return ((bars["previous_close"] > bars["previous_open"]) & (bars["close"] < bars["previous_open"])
+            & (bars["open"] > bars["previous_close"]))
+
+
+def pattern_hammer(bars, breakout_days):
+    body = np.abs(bars["close"] - bars["open"])
+    candle_range = bars["high"] - bars["low"]
+    lower_shadow = np.minimum(bars["open"], bars["close"]) - bars["low"]
+    upper_shadow = bars["high"] - np.maximum(bars["open"], bars["close"])
+    return (candle_range > 0) & (lower_shadow >= 2 * body) & (upper_shadow <= 0.25 * candle_range)
+
+
+def pattern_doji(bars, breakout_days):
+    candle_range = bars["high"] - bars["low"]
+    return (candle_range > 0) & (np.abs(bars["close"] - bars["open"]) <= 0.1 * candle_range)
+
+
+def pattern_inside_bar(bars, breakout_days):
+    return (bars["high"] < bars["previous_high"]) & (bars["low"] > bars["previous_low"])
+
+
+def pattern_breakout(bars, breakout_days):
+    # Highest high of the previous N bars, taken from sliding windows over the flat array. Windows that would reach
+    # into the previous symbol are masked out with the position of each bar inside its own symbol.
+    matches = np.zeros(len(bars["close"]), dtype=bool)
+    if len(bars["close"]) <= breakout_days:
+        return matches
+    window_high = np.lib.stride_tricks.sliding_window_view(bars["high"], breakout_days).max(axis=1)
+    matches[breakout_days:] = bars["close"][breakout_days:] > window_high[:-1]
+    return matches & (bars["position"] >= breakout_days)
+
+
+CANDLESTICK_PATTERNS = {"Bearish Engulfing": pattern_bearish_engulfing,
+                        "Hammer": pattern_hammer,
+                        "Doji": pattern_doji,
+                        "Inside Bar": pattern_inside_bar,
+                        "N-day Breakout": pattern_breakout}
+
+# The bullish engulfing is the pattern the breakout_signals table is kept up to date with, so its matches are read
+# from the table instead of being scanned again
+BREAKOUT_SIGNALS_PATTERN = "Bullish Engulfing"
+SCANNER_PATTERNS = [BREAKOUT_SIGNALS_PATTERN] + list(CANDLESTICK_PATTERNS)
+
+
+# Tab 📈 Trending
+# Function that runs the selected candlestick patterns over every symbol at once and returns the matches found in the
+# last days, most recent first. The bullish engulfing matches come from the breakout_signals table.
+@instrumented_memo(ttl=3600, show_spinner=True)
+def scan_candlestick_patterns(pattern_names, lookback_days, breakout_days):
+    universe = get_ohlc_universe(SCANNER_HISTORY_DAYS)
+    offsets = universe["offsets"]
+    bar_count = offsets[-1]
+    if bar_count == 0 or not pattern_names:
+        return pd.DataFrame(columns=["symbol", "date", "pattern", "close"])
+    bars = {column: universe[column] for column in ("open", "high", "low", "close")}
+    bars["position"] = np.arange(bar_count) - np.repeat(offsets[:-1], np.diff(offsets))
+    for column in ("open", "high", "low", "close"):
+        previous = np.roll(universe[column], 1)
+        previous[bars["position"] == 0] = np.nan
+        bars[f"previous_{column}"] = previous
+
+    recent = universe["date"] > universe["date"].max() - np.timedelta64(lookback_days, "D")
+    symbol_of_bar = np.repeat(universe["symbols"], np.diff(offsets))
+    matches = []
+    for pattern_name in pattern_names:
+        if pattern_name == BREAKOUT_SIGNALS_PATTERN:
+            signals = get_trending_stock(lookback_days)
+            matches.append(pd.DataFrame({"symbol": [signal["symbol"] for signal in signals],
+                                         "date": pd.to_datetime([signal["date"] for signal in signals]),
+                                         "pattern": pattern_name,
+                                         "close": [float(signal["close"]) for signal in signals]}))
+            continue
+        matched_bars = np.flatnonzero(CANDLESTICK_PATTERNS[pattern_name](bars, breakout_days) & recent)
+        matches.append(pd.DataFrame({"symbol": symbol_of_bar[matched_bars],
+                                     "date": universe["date"][matched_bars],
+                                     "pattern": pattern_name,
+                                     "close": universe["close"][matched_bars]}))
+    return pd.concat(matches).sort_values(["date", "symbol"], ascending=[False, True]).reset_index(drop=True)
+
+
+# Tab 📈 Trending
+# Processes that draw the chart thumbnails, shared by every session. Drawing is pure Python work that holds the GIL,
+# so it runs outside of the server process. The processes are spawned instead of forked, so they don't inherit the
+# threads of the server.
+@st.experimental_singleton
+def get_thumbnail_executor():
+    return ProcessPoolExecutor(max_workers=THUMBNAIL_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+
+
+# Tab 📈 Trending
+# Function that returns the thumbnail of every symbol, using the bars the pattern scanner already keeps in memory.
+# Thumbnails are content addressed by the symbol and the date of its last bar, so a thumbnail is only drawn once per
+# new bar. The missing ones are drawn at the same time by the thumbnail processes. Every thumbnail served gets its
+# modification time bumped, so the cleanup only removes the ones nobody asked for in THUMBNAIL_MAX_AGE_HOURS.
+@instrument
+def get_thumbnails(symbols):
+    universe = get_ohlc_universe(SCANNER_HISTORY_DAYS)
+    offsets = universe["offsets"]
+    symbol_rows = {symbol: row for row, symbol in enumerate(universe["symbols"])}
+    os.makedirs(THUMBNAIL_CACHE_DIR, exist_ok=True)
+
+    thumbnails, renders = {}, {}
+    for symbol in symbols:
+        if symbol not in symbol_rows:
+            continue
+        start, end = offsets[symbol_rows[symbol]], offsets[symbol_rows[symbol] + 1]
+        start = max(start, end - THUMBNAIL_BARS)
+        thumbnail_key = f"{symbol}|{universe['date'][end - 1]}|{THUMBNAIL_BARS}|{THUMBNAIL_SIZE}"
+        thumbnail_path = os.path.join(THUMBNAIL_CACHE_DIR,
+                                      f"{hashlib.sha1(thumbnail_key.encode()).hexdigest()}.png")
+        try:
+            os.utime(thumbnail_path)
+            thumbnails[symbol] = thumbnail_path
+            continue
+        except FileNotFoundError:
+            pass
+        bars = np.column_stack([universe[column][start:end] for column in ("open", "high", "low", "close")])
+        renders[symbol] = get_thumbnail_executor().submit(render_thumbnail, symbol, bars, thumbnail_path,
+                                                          THUMBNAIL_SIZE)
+
+    for symbol, render in renders.items():
+        thumbnails[symbol] = render.result()
+
+    if renders:
+        served_paths = set(thumbnails.values())
+        for thumbnail_file in os.listdir(THUMBNAIL_CACHE_DIR):
+            file_path = os.path.join(THUMBNAIL_CACHE_DIR, thumbnail_file)
+            if file_path in served_paths:
+                continue
+            try:
+                if time.time() - os.path.getmtime(file_path) > THUMBNAIL_MAX_AGE_HOURS * 3600:
+                    os.remove(file_path)
+            except OSError:
+                pass
+    return thumbnails
+
+
+# Tab 📈 Trending
+# Lock around the writes to the screener matrix, shared by every session and, through its lock file, by the nightly
+# job running in another process
+@st.experimental_singleton
+def get_screener_lock():
+    return threading.Lock()
+
+
+@contextmanager
+def screener_lock():
+    with get_screener_lock(), file_lock(os.path.join(SCREENER_DIR, ".lock")):
+        yield
+
+
+# Tab 📈 Trending
+# Function to read the meta.json of the screener, with the current matrix file, its symbols and its trading days
+def read_screener_meta():
+    meta_path = os.path.join(SCREENER_DIR, "meta.json")
+    if not os.path.exists(meta_path):
+        return {}
+    with open(meta_path) as meta_file:
+        return json.load(meta_file)
+
+
+def write_screener_meta(meta):
+    meta_path = os.path.join(SCREENER_DIR, "meta.json")
+    with open(f"{meta_path}.tmp", "w") as meta_file:
+        json.dump(meta, meta_file)
+    os.replace(f"{meta_path}.tmp", meta_path)
+
+
+# Tab 📈 Trending
+# Function to read the screener matrix, memory-mapped: the symbols of the rows, the trading days of the columns and
+# the closes, NaN on the days a symbol has no bar. Only the columns of the days already loaded are returned. When the
+# matrix is built again right after meta.json was read, meta.json is read again.
+def read_screener_matrix():
+    for attempt in range(2):
+        meta = read_screener_meta()
+        if not meta:
+            return np.array([], dtype=object), np.array([], dtype="datetime64[D]"), np.empty((0, 0))
+        try:
+            closes = np.load(os.path.join(SCREENER_DIR, meta["file"]), mmap_mode="r")
+            break
+        except FileNotFoundError:
+            if attempt:
+                raise
+    return (np.array(meta["symbols"], dtype=object), np.array(meta["days"], dtype="datetime64[D]"),
+            closes[:, :len(meta["days"])])
+
+
+# Tab 📈 Trending
+# Function that builds the screener matrix from scratch. The matrix is stored in Fortran order, so the closes of a
+# day are contiguous on disk and appending a day writes a single block, with spare columns for the days to come.
+def build_screener_matrix(symbols):
+    new_closes = copy_query_frame("""
+            SELECT symbol, date(date) AS date, close
+            FROM data_stocks_daily
+            WHERE date > (SELECT MAX(last_date) FROM symbol_stats) - interval '%s day'
+            """, (SCREENER_HISTORY_DAYS,), dtype={"symbol": "category", "close": np.float64}, parse_dates=["date"])
+    new_closes = new_closes[new_closes["symbol"].isin(symbols)]
+    days, day_columns = np.unique(new_closes["date"].to_numpy(dtype="datetime64[D]"), return_inverse=True)
+    symbol_rows = np.searchsorted(symbols, new_closes["symbol"].to_numpy(dtype=object))
+
+    os.makedirs(SCREENER_DIR, exist_ok=True)
+    file_name = f"closes-{time.time_ns()}.npy"
+    closes = np.lib.format.open_memmap(os.path.join(SCREENER_DIR, file_name), mode="w+", dtype=np.float64,
+                                       shape=(len(symbols), len(days) + SCREENER_SPARE_DAYS), fortran_order=True)
+    closes[:] = np.nan
+    closes[symbol_rows, day_columns] = new_closes["close"].to_numpy()
+    closes.flush()
+    write_screener_meta({"file": file_name, "symbols": list(symbols), "days": [str(day) for day in days]})
+
+    # Files still memory-mapped somewhere cannot be removed on every platform, those are cleaned up on the next build
+    for stale_file in os.listdir(SCREENER_DIR):
+        if stale_file.startswith("closes-") and stale_file != file_name:
+            try:
+                os.remove(os.path.join(SCREENER_DIR, stale_file))
+            except OSError:
+                pass
+
+
+# Tab 📈 Trending
+# Function that keeps the screener matrix up to date. The days after the last one loaded are appended as new columns
+# of the matrix, fetched with a range scan of the symbol and date index for every symbol. The last day loaded is
+# fetched and written again too, in case some of its bars came in after it was loaded. The matrix is only built again
+# when the list of symbols changes or the spare columns run out. Returns the last trading day in the matrix.
+@instrumented_memo(ttl=3600, show_spinner=True)
+@retry_on_disconnect
+def sync_screener_matrix():
+    symbols = np.array(sorted(get_symbol_stats()['symbol']), dtype=object)
+    with screener_lock():
+        meta = read_screener_meta()
+        if not meta or meta["symbols"] != list(symbols) or not meta["days"]:
+            build_screener_matrix(symbols)
+            meta = read_screener_meta()
+            return meta["days"][-1] if meta["days"] else None
+
+        new_closes = copy_query_frame("""
+                SELECT d.symbol, date(d.date) AS date, d.close
+                FROM data_stocks_daily d JOIN unnest(%s::text[]) AS screener(symbol) ON d.symbol = screener.symbol
+                WHERE d.date >= %s::date""", (list(symbols), meta["days"][-1]),
+                                      dtype={"symbol": "category", "close": np.float64}, parse_dates=["date"])
+        new_days, day_columns = np.unique(new_closes["date"].to_numpy(dtype="datetime64[D]"), return_inverse=True)
+        if len(new_days) == 0:
+            return meta["days"][-1]
+        closes = np.load(os.path.join(SCREENER_DIR, meta["file"]), mmap_mode="r+")
+        first_column = len(meta["days"]) - 1
+        if first_column + len(new_days) > closes.shape[1]:
+            build_screener_matrix(symbols)
+            return read_screener_meta()["days"][-1]
+
+        appended = np.full((len(symbols), len(new_days)), np.nan, order="F")
+        appended[np.searchsorted(symbols, new_closes["symbol"].to_numpy(dtype=object)), day_columns] = (
+            new_closes["close"].to_numpy())
+        closes[:, first_column:first_column + len(new_days)] = appended
+        closes.flush()
+        meta["days"] = meta["days"][:-1] + [str(day) for day in new_days]
+        write_screener_meta(meta)
+    return meta["days"][-1]
+
+
+# Tab 📈 Trending
+# Function that screens the whole universe in a single vectorized pass over the screener matrix: the return of the
+# last days of every symbol, its annualized volatility over the same days, and whether today's close is above the
+# highest close of the previous days (a new 52-week high by default). Symbols are kept when their return is at or
+# above a percentile of the universe, their volatility is under a cap, and optionally when they made a new high.
+@instrument
+def screen_stocks(return_days, min_return_percentile, max_volatility=None, new_high_only=False, high_days=252):
+    sync_screener_matrix()
+    symbols, days, closes = read_screener_matrix()
+    columns = ["symbol", "close", "return", "volatility", "previous_high", "new_high"]
+    if closes.shape[1] <= return_days or len(symbols) == 0:
+        return pd.DataFrame(columns=columns)
+
+    window = closes[:, -min(max(return_days, high_days) + 1, closes.shape[1]):]
+    last_close = window[:, -1]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        period_return = last_close / window[:, -1 - return_days] - 1
+        log_returns = np.diff(np.log(window[:, -1 - return_days:]), axis=1)
+        valid = ~np.isnan(log_returns)
+        return_count = valid.sum(axis=1)
+        mean_return = np.where(valid, log_returns, 0).sum(axis=1) / return_count
+        variance = (np.where(valid, log_returns - mean_return[:, None], 0) ** 2).sum(axis=1) / (return_count - 1)
+    volatility = np.sqrt(variance) * np.sqrt(PERIODS_PER_YEAR["Day"])
+    previous_high = np.fmax.reduce(window[:, -1 - high_days:-1], axis=1)
+    new_high = last_close > previous_high
+
+    selected = np.isfinite(period_return)
+    if not selected.any():
+        return pd.DataFrame(columns=columns)
+    selected &= period_return >= np.quantile(period_return[selected], min_return_percentile / 100)
+    if max_volatility:
+        selected &= volatility <= max_volatility
+    if new_high_only:
+        selected &= new_high
+    screened = pd.DataFrame({"symbol": symbols[selected], "close": last_close[selected],
+                             "return": period_return[selected], "volatility": volatility[selected],
+                             "previous_high": previous_high[selected], "new_high": new_high[selected]})
+    return screened.sort_values("return", ascending=False).reset_index(drop=True)
 
 
 # Tab 🔎 Search for Stocks
-# Function to obtain a list of the symbols that have at least 4 years of historical data, for the user to be able to
-# filter through in the tab
-@st.experimental_memo(show_spinner=True)
-def get_symbol_list():
-    data_full_set = cursor.execute("""
-                select symbol
-                FROM data_stocks_daily
-                WHERE char_length(data_stocks_daily.symbol) < 5
-                GROUP BY data_stocks_daily.symbol
-                HAVING COUNT(data_stocks_daily.index) > 1460
+# Function that keeps symbol_stats, the first date, last date, number of bars and last close of every symbol, up to
+# date. Every symbol of the table aggregates, with a range scan of the (symbol, date) index, only the bars after its
+# last date and adds them to its totals. The symbols not in the table yet are found with the index skip scan of
+# PRICE_SYMBOLS_CTE and aggregated from their first bar. The first build goes over the whole history, so the
+# statement timeout is lifted for this transaction.
+@instrumented_memo(ttl=3600, show_spinner=True)
+@retry_on_disconnect
+def refresh_symbol_stats():
+    with db_cursor() as cursor:
+        cursor.execute("SELECT pg_advisory_xact_lock(hashtext('symbol_stats'))")
+        cursor.execute("SET LOCAL statement_timeout = 0")
+        cursor.execute("""
+                CREATE TABLE IF NOT EXISTS symbol_stats (
+                    symbol TEXT PRIMARY KEY,
+                    first_date DATE NOT NULL,
+                    last_date DATE NOT NULL,
+                    bar_count BIGINT NOT NULL,
+                    last_close NUMERIC);
                 """)
+        cursor.execute(f"""
+                WITH RECURSIVE {PRICE_SYMBOLS_CTE}, tracked_symbols AS (
+                    SELECT symbol, last_date FROM symbol_stats
+                    UNION ALL
+                    SELECT symbol, NULL::date FROM price_symbols
+                    WHERE symbol IS NOT NULL
+                    AND NOT EXISTS (SELECT 1 FROM symbol_stats s WHERE s.symbol = price_symbols.symbol)
+                )
+                INSERT INTO symbol_stats (symbol, first_date, last_date, bar_count, last_close)
+                SELECT t.symbol, b.first_date, b.last_date, b.bar_count, b.last_close
+                FROM tracked_symbols t
+                CROSS JOIN LATERAL (
+                    SELECT MIN(date(d.date)) AS first_date, MAX(date(d.date)) AS last_date, COUNT(*) AS bar_count,
+                    (array_agg(d.close ORDER BY d.date DESC))[1] AS last_close
+                    FROM data_stocks_daily d
+                    WHERE d.symbol = t.symbol AND d.date >= COALESCE(t.last_date + 1, '-infinity'::date)
+                ) b
+                WHERE b.bar_count > 0
+                ON CONFLICT (symbol) DO UPDATE
+                SET first_date = LEAST(symbol_stats.first_date, EXCLUDED.first_date),
+                last_date = GREATEST(symbol_stats.last_date, EXCLUDED.last_date),
+                bar_count = symbol_stats.bar_count + EXCLUDED.bar_count,
+                last_close = EXCLUDED.last_close""")
+        symbols_updated = cursor.rowcount
+    return symbols_updated
 
-    list_symbols_data = cursor.fetchall()
-    return list_symbols_data
 
+# Tab 🔎 Search for Stocks
+# Function to fetch the stats of every symbol, a small table that is kept in memory for the side panel filters
+@instrumented_memo(ttl=3600, show_spinner=True)
+@retry_on_disconnect
+def get_symbol_stats():
+    refresh_symbol_stats()
+    symbol_stats = copy_query_frame("SELECT symbol, first_date, last_date, bar_count, last_close FROM symbol_stats",
+                                    dtype={"symbol": str, "bar_count": np.int64, "last_close": np.float64},
+                                    parse_dates=["first_date", "last_date"])
+    return symbol_stats
 
-symbols_list_comp = []
-list_symbols = get_symbol_list()
 
-for row in list_symbols:
-    symbols_list_comp.append(row['symbol'])
-
-symbols_list_comp.sort()
+# Tab 🔎 Search for Stocks
+# Function to obtain a list of the symbols that have at least 4 years of historical data (1460 bars), for the user to
+# be able to filter through in the tab. Symbols can also be limited to the ones with bars in the last days, and the
+# ones without any bar in the SEARCH_HISTORY_DAYS the tab shows are always left out.
+@instrument
+def get_symbol_list(min_bars=1460, active_days=None):
+    symbol_stats = get_symbol_stats()
+    first_day = pd.Timestamp.today().normalize() - pd.Timedelta(days=SEARCH_HISTORY_DAYS)
+    selected = ((symbol_stats['symbol'].str.len() < 5) & (symbol_stats['bar_count'] > min_bars)
+                & (symbol_stats['last_date'] > first_day))
+    if active_days:
+        selected &= symbol_stats['last_date'] > symbol_stats['last_date'].max() - datetime.timedelta(days=active_days)
+    return symbol_stats.loc[selected, ['symbol']].to_dict('records')
 
 
 # Tab 🔎 Search for Stocks
 # Function that runs an API request to obtain the information for a company
 # with that it is paired with preselected fields to display, limiting the information for the tab.
 # And a iterations to match both the API results with the preselected fields
-@st.experimental_memo(show_spinner=True)
-def yahoo_company_info(ticker):
+def fetch_yahoo_company_info(ticker):
+    import yfinance as yf
+
     symbol_info_company = yf.Ticker(ticker)
     company_info = symbol_info_company.info
     company_information_layout = ["longName", "symbol", "quoteType", "sector", "market", "exchange",
@@ -137,8 +1765,136 @@ def yahoo_company_info(ticker):
     return out
 
 
+# Tab 🔎 Search for Stocks
+# Functions to read and write the company profiles kept on disk, one JSON file per symbol with the time it was fetched
+def read_company_cache(ticker):
+    cache_path = os.path.join(COMPANY_CACHE_DIR, f"{ticker}.json")
+    if not os.path.exists(cache_path):
+        return None, None
+    try:
+        with open(cache_path) as cache_file:
+            cache_entry = json.load(cache_file)
+    except (OSError, ValueError):
+        return None, None
+    return cache_entry["profile"], cache_entry["fetched_at"]
+
+
+def write_company_cache(ticker, profile):
+    os.makedirs(COMPANY_CACHE_DIR, exist_ok=True)
+    cache_path = os.path.join(COMPANY_CACHE_DIR, f"{ticker}.json")
+    temporary_path = f"{cache_path}.{threading.get_ident()}.tmp"
+    with open(temporary_path, "w") as cache_file:
+        json.dump({"profile": profile, "fetched_at": time.time()}, cache_file)
+    os.replace(temporary_path, cache_path)
+
+
+# Tab 🔎 Search for Stocks
+# Background workers shared by every session, used to revalidate stale profiles and to prefetch the whole universe.
+# The set keeps track of the symbols being fetched so the same symbol is never requested twice at the same time.
+@st.experimental_singleton
+def get_company_fetcher_pool():
+    return {"executor": ThreadPoolExecutor(max_workers=COMPANY_PREFETCH_WORKERS),
+            "lock": threading.Lock(),
+            "in_flight": set()}
+
+
+# Tab 🔎 Search for Stocks
+# Function that fetches a company profile and saves it to the cache. When the API call fails, or comes back empty,
+# the last profile known for the symbol is returned instead.
+def refresh_company_profile(ticker, fetcher=fetch_yahoo_company_info):
+    try:
+        profile = fetcher(ticker)
+    except Exception:
+        profile = None
+    if profile:
+        write_company_cache(ticker, profile)
+        return profile
+    cached_profile, _ = read_company_cache(ticker)
+    return cached_profile if cached_profile is not None else {}
+
+
+def refresh_company_profile_in_background(ticker, fetcher=fetch_yahoo_company_info):
+    fetcher_pool = get_company_fetcher_pool()
+    with fetcher_pool["lock"]:
+        if ticker in fetcher_pool["in_flight"]:
+            return None
+        fetcher_pool["in_flight"].add(ticker)
+
+    def refresh_and_release():
+        try:
+            return refresh_company_profile(ticker, fetcher)
+        finally:
+            with fetcher_pool["lock"]:
+                fetcher_pool["in_flight"].discard(ticker)
+
+    return fetcher_pool["executor"].submit(refresh_and_release)
+
+
+# Tab 🔎 Search for Stocks
+# Function to obtain the profile of a company with stale-while-revalidate: a cached profile is returned right away,
+# and if it is older than its TTL a new one is fetched in the background for the next view. Only a symbol that was
+# never fetched waits for the API.
+def get_company_profile(ticker, fetcher=fetch_yahoo_company_info, ttl=COMPANY_INFO_TTL):
+    cached_profile, fetched_at = read_company_cache(ticker)
+    if cached_profile is None:
+        return refresh_company_profile(ticker, fetcher)
+    if time.time() - fetched_at > ttl:
+        refresh_company_profile_in_background(ticker, fetcher)
+    return cached_profile
+
+
+# Tab 🔎 Search for Stocks
+# Function that warms the profile cache for a list of symbols, fetching the missing and stale ones in parallel.
+# Returns the futures of the fetches started, so callers can wait for them or let them run in the background.
+def prefetch_company_profiles(tickers, fetcher=fetch_yahoo_company_info, ttl=COMPANY_INFO_TTL):
+    prefetches = []
+    for ticker in tickers:
+        cached_profile, fetched_at = read_company_cache(ticker)
+        if cached_profile is None or time.time() - fetched_at > ttl:
+            prefetch = refresh_company_profile_in_background(ticker, fetcher)
+            if prefetch is not None:
+                prefetches.append(prefetch)
+    return prefetches
+
+
+# Tab 🔎 Search for Stocks
+# Prefetch of the profiles for the whole symbol list, started once per server process and symbol list. Reading the
+# cached profile of every symbol runs in the background workers too, so the rerun that starts it doesn't wait for it.
+@st.experimental_singleton
+def start_company_profile_prefetch(tickers):
+    return get_company_fetcher_pool()["executor"].submit(prefetch_company_profiles, tickers)
+
+
+# Tab 🔎 Search for Stocks
+# Company information displayed in the tab, served from the profile cache
+@instrument
+def yahoo_company_info(ticker):
+    return get_company_profile(ticker.upper())
+
+
+# Threads that run the loads of a tab, shared by every session. The database calls still go through the bounded
+# connection pool.
+@st.experimental_singleton
+def get_fetch_executor():
+    return ThreadPoolExecutor(max_workers=FETCH_WORKERS, thread_name_prefix="fetch")
+
+
+# Function that starts the independent loads of a tab at the same time, each one given as (function, *arguments),
+# and returns a dictionary with the future of every load. The threads get the context of the rerun, but the loads
+# must not draw anything (like the spinner of a memo function) since only the main thread writes to the page.
+def start_fetches(**loads):
+    script_run_ctx = get_script_run_ctx()
+
+    def run_in_rerun(func, *args):
+        add_script_run_ctx(threading.current_thread(), script_run_ctx)
+        return func(*args)
+
+    return {name: get_fetch_executor().submit(run_in_rerun, *load) for name, load in loads.items()}
+
+
 if option == '🏠 Home':
     st.title('🏠 Welcome!')
+    record_first_paint(option)
     st.markdown("## Thank you for taking the time to look through my work. ##")
 
     home_about_project, home_about_others = st.columns(2)
@@ -617,6 +2373,18 @@ if option == '🔎 Search for Stocks':
     # Title and container for stock information in the Title
     title_search_stock, company_name_title, stock_search_stock = st.columns([.8, 3, .5])
     title_search_stock.title("🔎 Data for:")
+    record_first_paint(option)
+    import plotly.graph_objects as go
+    from plotly.subplots import make_subplots
+
+    # Filters for the list of symbols, answered from the symbol stats kept in memory
+    min_bars_history = st.sidebar.slider('Minimum bars of history', 0, 3650, 1460, step=10)
+    active_days = st.sidebar.number_input('Active in the last days (0 = any)', min_value=0, value=0)
+    symbols_list_comp = sorted(row['symbol'] for row in get_symbol_list(min_bars_history, active_days))
+    if not symbols_list_comp:
+        st.warning("No symbols match the filters on the side panel.")
+        render_diagnostics_panel()
+        st.stop()
 
     # Stock's Symbol selection box on side panel
     symbol = st.sidebar.selectbox(label="Symbols", options=symbols_list_comp)
@@ -627,11 +2395,13 @@ if option == '🔎 Search for Stocks':
     # Stock Symbol
     stock_search_stock.title(f"__${symbol.upper()}__")
 
-    # Yahoo Finance API call for company's information to match with preselected values under company_information_layout
-    out = yahoo_company_info(symbol)
-
-    company_name_filtered = out['longName']
-    company_name_title.title(f"__{company_name_filtered}__")
+    # Yahoo Finance API call for company's information and the price history are loaded at the same time, and every
+    # section below is shown as soon as its own data arrives
+    fetches = start_fetches(company=(yahoo_company_info, symbol),
+                            bars=(get_search_bars, symbol, timeframe_for_data))
+    # The profiles of every listed symbol are prefetched in the background, for the whole list rather than the
+    # filtered one so changing the filters doesn't start it again
+    start_company_profile_prefetch(tuple(sorted(row['symbol'] for row in get_symbol_list(min_bars=0))))
 
     # About this tab & Company information expandable blocks
     about_this_tab, about_company_information = st.columns([3, 3])
@@ -644,15 +2414,16 @@ if option == '🔎 Search for Stocks':
         historical data set for over ten years. The dataset is placed into a pandas DataFrame for the graphs below. 
         Another feature for this tab is the Timescale selection box at the top of the page, which allows the user to 
         decide whether to aggregate the data by year, month, week, or daily for the analysis. For this feature, 
-        I ran an if statement to change the date format of the DateTime column to the timescale the user selected. On 
-        the side panel, you can decide how far back you would like to review the data. Further down, I calculate the 
+        every date is mapped to the first day of its period with NumPy and the candles of each period are aggregated 
+        in a single pass, cached for every stock and timescale. Technical indicators picked in the Chart settings 
+        are computed with NumPy and pandas and only extended with the new bars when the data is updated. On the 
+        side panel, you can decide how far back you would like to review the data. Further down, I calculate the 
         percentage of change in the DataFrame for the histogram to understand the distribution of a historical data 
         set and its percent of change over time. The Company Information section is acquired through an API call 
         using the YFinance Library. The output is placed into a dictionary and then matched with specific labels to 
         only display limited information for the company, effectively choosing what to show instead of displaying 
         all of the output.""")
-    with about_company_information.expander(a):
-        hello = [st.write(f"**{i}:**", out[i]) for i in out]
+    company_information = about_company_information.expander(a)
 
     # Yahoo Finance links
     url1, url2 = st.columns([4, 2])
@@ -661,31 +2432,31 @@ if option == '🔎 Search for Stocks':
     url2.write(f"**Yahoo Stock Info link: {url2_text}**")
     url1.write(f"**Yahoo Stock Chart link: {url1_text}**")
 
-    # Bring in Data from Function into a Dataframe
-
-    df = pd.DataFrame(get_data_search(symbol))
-    df['date'] = pd.to_datetime(df['date'].astype(str))
-    df['open'] = pd.to_numeric(df['open'])
-    df['high'] = pd.to_numeric(df['high'])
-    df['low'] = pd.to_numeric(df['low'])
-    df['close'] = pd.to_numeric(df['close'])
-
-    # Depending on the User selection for timeframe, apply the following logic
-    if timeframe_for_data == 'Week':
-        df = df.groupby(df.date.dt.strftime('%Y-W%U')).agg(
-            {'open': 'first', 'close': 'last', 'low': 'min', 'high': 'max'}).reset_index()
-        df['percent_change'] = ((df['close'] - df['open']) / df['open'])
-    elif timeframe_for_data == 'Month':
-        df = df.groupby(df.date.dt.strftime('%Y-%m')).agg(
-            {'open': 'first', 'close': 'last', 'low': 'min', 'high': 'max'}).reset_index()
-        df['percent_change'] = ((df['close'] - df['open']) / df['open'])
-    elif timeframe_for_data == 'Year':
-        df = df.groupby(df.date.dt.strftime('%Y')).agg(
-            {'open': 'first', 'close': 'last', 'low': 'min', 'high': 'max'}).reset_index()
-        df['percent_change'] = ((df['close'] - df['open']) / df['open'])
-    elif timeframe_for_data == 'Day':
-        df['percent_change'] = ((df['close'] - df['open']) / df['open'])
-        date_time = df['date'].dt.strftime('%d/%m/%Y')
+    # Company name and information are matched with preselected values, filled in whenever the profile arrives
+    def show_company_information(out):
+        company_name_filtered = out.get('longName', symbol.upper())
+        company_name_title.title(f"__{company_name_filtered}__")
+        with company_information:
+            hello = [st.write(f"**{i}:**", out[i]) for i in out]
+
+    # A single spinner is drawn from here while the loads run in the fetch threads
+    company_shown = False
+    with st.spinner(f"Loading {symbol.upper()}..."):
+        for fetch in as_completed(fetches.values()):
+            if fetch is not fetches['company']:
+                break
+            show_company_information(fetch.result())
+            company_shown = True
+
+        # Bring in Data from Function into a Dataframe
+
+        # Depending on the User selection for timeframe, the candles come aggregated by Year, Month, Week or Day,
+        # each one labeled with the first date of its period
+        df = fetches['bars'].result()
+    if df.empty:
+        st.warning(f"There are no bars of {symbol.upper()} in the last {SEARCH_HISTORY_DAYS} days.")
+        render_diagnostics_panel()
+        st.stop()
 
     # Slider to control date range for data analysis
     data_days = st.sidebar.slider(f'Number of {timeframe_for_data}s', min_value=1, max_value=len(df.index),
@@ -695,17 +2466,77 @@ if option == '🔎 Search for Stocks':
     # Cleaning up some of the date texts in case it displays time as well
     df['date'] = df['date'].astype(str).str[:10]
 
-    # Candlestick chart
-    fig = go.Figure(data=[go.Candlestick(x=df['date'],
-                                         open=df['open'],
-                                         high=df['high'],
-                                         low=df['low'],
-                                         close=df['close'],
-                                         name=symbol)])
-    fig.update_xaxes(type='category')
-    fig.update_layout(height=700, title_text=f"Candlestick Chart by {timeframe_for_data} for {symbol.upper()}",
-                      xaxis_title_text=f'{timeframe_for_data}s')
-    st.plotly_chart(fig, use_container_width=True)
+    # Chart settings: the width of the chart decides how many candles get drawn, and the zoom range shows a part of
+    # the history in full detail, since fewer candles have to be merged to fit in the chart
+    with st.sidebar.expander("Chart settings"):
+        chart_width = st.number_input('Chart width in pixels', min_value=300, max_value=4000, value=1400, step=100)
+        zoom_range = st.select_slider('Zoom', options=list(df['date']), value=(df['date'].iloc[0], df['date'].iloc[-1]))
+        indicators_selected = st.multiselect('Indicators', list(INDICATORS))
+        indicator_params = {}
+        for indicator_name in indicators_selected:
+            indicator_params[indicator_name] = tuple(
+                st.number_input(f'{indicator_name} {param_name}', min_value=type(default)(1), value=default)
+                for param_name, default in INDICATORS[indicator_name]['params'].items())
+    zoomed_df = df[(df['date'] >= zoom_range[0]) & (df['date'] <= zoom_range[1])]
+    chart_df, candles_merged = decimate_ohlc(zoomed_df, chart_width // CHART_CANDLE_PIXELS)
+
+    # Candlestick chart, with the indicators that go over the candles drawn on it and every other indicator on its
+    # own panel below. Indicators take the value of the last bar of every merged candle.
+    subplot_indicators = [indicator_name for indicator_name in indicators_selected
+                          if INDICATORS[indicator_name]['subplot']]
+    with measure("candlestick chart") as chart_measurement:
+        chart_measurement["result"] = chart_df
+        chart_title = f"Candlestick Chart by {timeframe_for_data} for {symbol.upper()}"
+        if candles_merged > 1:
+            chart_title += f" ({candles_merged} {timeframe_for_data}s per candle)"
+        fig = make_subplots(rows=1 + len(subplot_indicators), cols=1, shared_xaxes=True, vertical_spacing=0.03,
+                            row_heights=[3] + [1] * len(subplot_indicators))
+        fig.add_trace(go.Candlestick(x=chart_df['date'],
+                                     open=chart_df['open'],
+                                     high=chart_df['high'],
+                                     low=chart_df['low'],
+                                     close=chart_df['close'],
+                                     name=symbol), row=1, col=1)
+        zoomed_dates = pd.to_datetime(zoomed_df['date'])
+        for indicator_name in indicators_selected:
+            indicator = get_indicator(symbol, timeframe_for_data, indicator_name, indicator_params[indicator_name])
+            indicator = indicator.reindex(zoomed_dates)
+            indicator_row = 2 + subplot_indicators.index(indicator_name) if indicator_name in subplot_indicators else 1
+            for column in indicator.columns:
+                column_values = decimate_last(indicator[column].to_numpy(), candles_merged)
+                if column.endswith('histogram'):
+                    fig.add_trace(go.Bar(x=chart_df['date'], y=column_values, name=column), row=indicator_row, col=1)
+                else:
+                    fig.add_trace(go.Scatter(x=chart_df['date'], y=column_values, name=column, mode='lines',
+                                             line=dict(width=1)), row=indicator_row, col=1)
+        fig.update_xaxes(type='category')
+        fig.update_xaxes(title_text=f'{timeframe_for_data}s', row=1 + len(subplot_indicators), col=1)
+        fig.update_layout(height=700 + 200 * len(subplot_indicators), title_text=chart_title,
+                          xaxis_rangeslider_visible=not subplot_indicators)
+        st.plotly_chart(fig, use_container_width=True)
+
+    # When the price history arrived first, the company information is shown once the chart is out
+    if not company_shown:
+        show_company_information(fetches['company'].result())
+
+    # Comparison mode: the performance of several symbols over the same dates, every line starting at 0%
+    with st.expander("📊 Compare symbols"):
+        comparison_symbols = st.multiselect('Symbols to compare', symbols_list_comp, default=[symbol])
+        comparison_period = st.selectbox('Period', list(COMPARISON_PERIODS), index=3)
+        if len(comparison_symbols) > 1:
+            closes = get_comparison_closes(comparison_symbols, COMPARISON_PERIODS[comparison_period])
+            if len(closes.index) < 2:
+                st.warning("The symbols selected have no dates in common in this period.")
+            else:
+                performance = closes / closes.iloc[0] - 1
+                with measure("comparison chart"):
+                    fig_compare = go.Figure(data=[go.Scatter(x=performance.index, y=performance[compared],
+                                                             mode='lines', name=compared)
+                                                  for compared in performance.columns])
+                    fig_compare.update_layout(height=500, yaxis_tickformat='.0%',
+                                              title_text=f"Performance over {comparison_period}")
+                    st.plotly_chart(fig_compare, use_container_width=True)
+                st.dataframe(comparison_returns(closes).style.format("{:.2%}"))
 
     # Information about the probability chart coming up
     displo_header = st.header("**Histogram for Probability**")
@@ -723,26 +2554,38 @@ if option == '🔎 Search for Stocks':
             '***, .03124)*** **<-** this number represent the probability of that event historically. '
             ' **Multiply this number by 100 to get the probability in %.**')
 
-    # Dataset is cleaned up for Probability chart
-    df['percent_change'] = pd.to_numeric(df['percent_change'], errors='coerce')
+    # Dataset is cleaned up for the table below
     df['percent_change'] = round(df['percent_change'], 2)
-    list1 = [list(df['percent_change'].values)]
-    group_labels = ['percent_change']  # name of the dataset
     df = round(df, 3)
 
-    # Color for Probability chart
+    # Color for Probability chart, other stocks to compare the distribution with, and the size of the move used for
+    # the probability of a move beyond ±X%
     color = st.color_picker('Pick A Color')
-    colors = '#622E2E'
     colors2 = color
-
-    # Probability chart
-    fig1 = go.Figure(
-        data=[go.Histogram(x=df['percent_change'], histnorm='probability', marker_color=colors2, autobinx=True)])
-    fig1.update_xaxes()
-    fig1.update_layout(height=700)
-    fig1.update_layout(title_text=f"Probability Graph for {symbol.upper()}", bargap=0.02,
-                       bargroupgap=0.02, xaxis_title_text='% Change', yaxis_title_text='% Probability')
-    st.plotly_chart(fig1, use_container_width=True)
+    distribution_symbols = [symbol] + st.multiselect('Compare distribution with',
+                                                     [other_symbol for other_symbol in symbols_list_comp
+                                                      if other_symbol != symbol])
+    move_threshold = st.number_input('Probability of a move beyond ±X%', min_value=0.0, value=5.0, step=0.5) / 100
+
+    # Probability chart, the bins are computed on the server and only the probability of each bin is sent
+    with measure("probability chart"):
+        fig1 = go.Figure()
+        distribution_stats = {}
+        for distribution_symbol in distribution_symbols:
+            distribution = get_percent_change_distribution(distribution_symbol.upper(), timeframe_for_data,
+                                                           data_days, move_threshold,
+                                                           sync_ohlc_store(distribution_symbol.upper()))
+            distribution_stats[distribution_symbol.upper()] = distribution['stats']
+            fig1.add_trace(go.Bar(x=distribution['bin_start'] + HISTOGRAM_BIN_WIDTH / 2,
+                                  y=distribution['probability'], width=HISTOGRAM_BIN_WIDTH,
+                                  name=distribution_symbol.upper(),
+                                  marker_color=colors2 if distribution_symbol == symbol else None,
+                                  opacity=1 if len(distribution_symbols) == 1 else 0.6))
+        fig1.update_layout(height=700, barmode='overlay')
+        fig1.update_layout(title_text=f"Probability Graph for {', '.join(distribution_stats)}", bargap=0.02,
+                           bargroupgap=0.02, xaxis_title_text='% Change', yaxis_title_text='% Probability')
+        st.plotly_chart(fig1, use_container_width=True)
+    st.dataframe(pd.DataFrame(distribution_stats).T)
 
     # Fillers used to display dataframe and download link in the middle
     filler_5, dataframe_Title, filler_6 = st.columns([2.28, 2, 1])
@@ -751,18 +2594,38 @@ if option == '🔎 Search for Stocks':
 
     dataframe_Title.subheader("Historic Dataset")
     dataframe_search.dataframe(df, width=1000)
-    csv = convert_df(df)
 
-    link_dataset_search.download_button(
-        label="Download data as CSV",
-        data=csv,
-        file_name=f'Historic Dataset for {symbol.upper()}.csv',
-        mime='text/csv',
-    )
+    # The export is only built when the user asks for it, written to disk in chunks and only built again when there
+    # are new bars
+    export_format = link_dataset_search.selectbox('Export format', list(EXPORT_FORMATS))
+    export_extension, export_mime = EXPORT_FORMATS[export_format]
+    if link_dataset_search.button(f"Prepare {export_format} download"):
+        with open(build_export([symbol], timeframe_for_data, export_format, data_days), 'rb') as export_file:
+            link_dataset_search.download_button(
+                label=f"Download data as {export_format}",
+                data=export_file,
+                file_name=f'Historic Dataset for {symbol.upper()}.{export_extension}',
+                mime=export_mime,
+            )
+
+    # Bulk export of several symbols into a single archive
+    with link_dataset_search.expander("🗜️ Bulk export"):
+        bulk_symbols = st.multiselect('Symbols to export', symbols_list_comp, default=[symbol])
+        if st.button("Prepare archive") and bulk_symbols:
+            with open(build_export(bulk_symbols, timeframe_for_data, export_format), 'rb') as bulk_file:
+                st.download_button(
+                    label=f"Download {len(bulk_symbols)} symbols as {export_format}",
+                    data=bulk_file,
+                    file_name=f'Historic Datasets by {timeframe_for_data}.'
+                              f'{"zip" if len(bulk_symbols) > 1 else export_extension}',
+                    mime='application/zip' if len(bulk_symbols) > 1 else export_mime,
+                )
 
 if option == '🚀 Wallstreetbets':
     # Title
     st.title(option)
+    record_first_paint(option)
+    import plotly.graph_objects as go
 
     filler_wsbt_1, wsbt_about_tab, filler_wsbt_2 = st.columns([.3, 5.6, .6])
     with wsbt_about_tab.expander("🔖 About this tab"):
@@ -771,9 +2634,11 @@ if option == '🚀 Wallstreetbets':
         data set for the user to filter through in the side panel and the count of times a particular stock 
         was mentioned in the Reddit forum. The data is then placed into a graph depicting the most mentioned stock 
         out of all the other stocks. The second function fetches another set of data that contains the Reddit 
-        post, Stock symbol, author, and URL. This data set is then placed into an iteration that unpack the 
-        posts based on the symbol that was selected. If no symbol was selected the iterations unpacks 100 recent 
-        posts.""")
+        post, Stock symbol, author, and URL, one page of 100 posts at a time. The posts are filtered by the symbol 
+        and the dates selected, and the buttons below the chart move to older or newer pages. If no symbol was 
+        selected the 100 most recent posts are displayed. The search box runs a full-text search over the messages 
+        and authors of the posts, using a full-text index kept by the database, and ranks the 1,000 most recent 
+        matches by relevance.""")
 
     # Slider input that gets placed into the get_data_wsbt function that does a SQL call/
     # filter how many days to look back to in the dataset for Wallstreetbets Query
@@ -801,13 +2666,18 @@ if option == '🚀 Wallstreetbets':
                                        options=list_wsbt_symbols_df,
                                        key="WSTB_Symbol")
 
-    # When the user selects a particular stock the lambda will call all the mentions of that stock.
-    # mentions = get_dict_wsb() is the line we used earlier to call the function.
+    # Optional date range for the mentions listed under the chart
+    mention_start_date, mention_end_date = None, None
+    if st.sidebar.checkbox("Filter mentions by date", key="WSTB_Date_Filter"):
+        mention_dates = st.sidebar.date_input("Mentions between",
+                                              (pd.Timestamp.today() - pd.Timedelta(days=num_days),
+                                               pd.Timestamp.today()))
+        if len(mention_dates) == 2:
+            mention_start_date, mention_end_date = mention_dates
+
+    # When the user selects a particular stock the chart and the mentions are filtered to that stock.
     if symbol_wsbt != "":
         dataframe_wsbt_fullset = dataframe_wsbt_fullset[dataframe_wsbt_fullset['symbol'] == symbol_wsbt]
-        mentioned_t = list(filter(lambda x: x[0] == symbol_wsbt, mentions))
-    else:
-        mentioned_t = mentions
 
     # Color for the bar graph
     colors = ['lightslategray', ] * 100
@@ -817,53 +2687,118 @@ if option == '🚀 Wallstreetbets':
 
     # Plotly bar graph
     # list comprehension to put both the Symbol and Name in the X field in a formatted string
-    fig = go.Figure(data=[go.Bar(x=(["%s<br>%s" % (l, w) for l, w in zip(dataframe_wsbt_fullset['symbol'],
-                                                                         dataframe_wsbt_fullset['name'])]),
-                                 y=dataframe_wsbt_fullset['num_mentions'], marker_color=colors,
-                                 text=dataframe_wsbt_fullset['num_mentions'], textposition='auto', hovertext="  ",
-                                 textfont=dict(family="sans serif", color="white", size=16))])
-    fig.update_layout(
-        title_text="Top Stocks Mentioned in WSBT")
-    st.plotly_chart(fig, use_container_width=True)
-
-    # for loop to unpack the mentions from reddit post. limit up to 100
-    for mention in mentioned_t[:100]:
-        st.subheader(mention['symbol'])
-        st.text(mention['dt'])
-        st.text(mention['author'])
-        st.text(mention['message'])
-        st.text(mention['url'])
+    with measure("mentions chart"):
+        fig = go.Figure(data=[go.Bar(x=(["%s<br>%s" % (l, w) for l, w in zip(dataframe_wsbt_fullset['symbol'],
+                                                                             dataframe_wsbt_fullset['name'])]),
+                                     y=dataframe_wsbt_fullset['num_mentions'], marker_color=colors,
+                                     text=dataframe_wsbt_fullset['num_mentions'], textposition='auto',
+                                     hovertext="  ", textfont=dict(family="sans serif", color="white", size=16))])
+        fig.update_layout(
+            title_text="Top Stocks Mentioned in WSBT")
+        st.plotly_chart(fig, use_container_width=True)
+
+    # Full-text search over the messages and authors of the mentions, the most recent matches ranked by relevance
+    search_text = st.text_input("🔍 Search mentions", placeholder='e.g. "short squeeze" -puts').strip()
+
+    # Keyset pagination of the mentions. The session keeps the (dt, id) where every page visited starts, and goes
+    # back to the first page whenever the filters change. Search results are paged by their position instead.
+    page_filters = (symbol_wsbt, mention_start_date, mention_end_date, search_text)
+    if st.session_state.get("wsb_page_filters") != page_filters:
+        st.session_state["wsb_page_filters"] = page_filters
+        st.session_state["wsb_page_starts"] = [(None, None)]
+    page_starts = st.session_state["wsb_page_starts"]
+
+    # With a symbol selected the mentions are looked up in the per-symbol mention index.
+    def load_mentions_page(page_start):
+        if search_text:
+            search_page, match_count = search_mentions(search_text, symbol_wsbt or None, mention_start_date,
+                                                       mention_end_date, (len(page_starts) - 1) * MENTIONS_PAGE_SIZE)
+            capped = "+" if match_count >= MENTION_SEARCH_CANDIDATES else ""
+            return search_page, f"{match_count}{capped} mentions match {search_text}"
+        if symbol_wsbt != "":
+            symbol_mentions, symbol_mention_count = get_symbol_mentions_page(symbol_wsbt, mention_start_date,
+                                                                             mention_end_date, *page_start)
+            return symbol_mentions, f"{symbol_mention_count} mentions of {symbol_wsbt}"
+        return get_mentions_page(None, mention_start_date, mention_end_date, *page_start), ""
+
+    newer_page, page_number, older_page = st.columns([1, 4, 1])
+    newer_label, older_label = ("⬅ Previous", "Next ➡") if search_text else ("⬅ Newer", "Older ➡")
+    if newer_page.button(newer_label) and len(page_starts) > 1:
+        page_starts.pop()
+    mentioned_t, mentions_caption = load_mentions_page(page_starts[-1])
+    if older_page.button(older_label) and len(mentioned_t) == MENTIONS_PAGE_SIZE:
+        page_starts.append((mentioned_t[-1]['dt'], mentioned_t[-1]['id']))
+        mentioned_t, mentions_caption = load_mentions_page(page_starts[-1])
+    page_number.caption(f"Page {len(page_starts)} {mentions_caption}")
+
+    # for loop to unpack the mentions from reddit post, one page at a time
+    with measure("mentions list") as list_measurement:
+        list_measurement["result"] = mentioned_t
+        for mention in mentioned_t:
+            st.subheader(mention['symbol'])
+            st.text(mention['dt'])
+            st.text(mention['author'])
+            st.text(mention['message'])
+            st.text(mention['url'])
 
 if option == '📈 Trending':
     # Title
     st.title(option)
+    record_first_paint(option)
 
     wsbt_trend_tab, filler_trend_2 = st.columns([5.6, 3.3])
     with wsbt_trend_tab.expander("🔖 About this tab"):
-        st.write("""The 📈 Trending tab fetches a SQL query using a function. The function runs through the data and 
-        calculates the stocks that appear to be trending in a particular timeframe. The selection of the number of 
-        days is the input argument for this function. The calculation done is a standard break-out pattern executed 
-        through a SQL code within the function.""")
-
-    # Number of days slider to tell the function get_trending_stock() how far back to analyze the data to find matches
+        st.write("""The 📈 Trending tab loads the recent price history of every stock into NumPy arrays, one 
+        contiguous block per symbol, and runs a library of candlestick patterns over all of them at once. The user 
+        picks which patterns to look for and how many days back to search for matches, and the N-day breakout 
+        pattern flags the stocks closing above their highest high of the previous N days. The charts of the matches 
+        are drawn from the same arrays and cached on disk until the next bar comes in. The screener keeps the closes 
+        of every stock in a memory-mapped matrix of stocks by trading days, one new column per day, and filters the 
+        whole market by return, volatility and new highs at once.""")
+
+    # Screener over every stock, by return over the last days, volatility and new 52-week highs
+    with st.expander("🧮 Screener"):
+        screener_return_days, screener_percentile, screener_volatility, screener_new_high = st.columns(4)
+        return_days = screener_return_days.slider('Return over days', 5, 60, 20)
+        min_return_percentile = screener_percentile.slider('Return at or above percentile', 0, 99, 90)
+        max_volatility = screener_volatility.number_input('Max annualized volatility % (0 = any)', min_value=0.0,
+                                                          value=0.0, step=5.0) / 100
+        new_high_only = screener_new_high.checkbox('New 52-week high today')
+        screened = screen_stocks(return_days, min_return_percentile, max_volatility, new_high_only)
+        st.caption(f"{len(screened.index)} stocks")
+        st.dataframe(screened.style.format({"close": "{:.2f}", "return": "{:.2%}", "volatility": "{:.2%}",
+                                            "previous_high": "{:.2f}"}))
+
+    # Patterns to look for, and number of days slider to tell the scanner how far back to look for matches
+    patterns_selected = st.sidebar.multiselect('Patterns', SCANNER_PATTERNS, default=[BREAKOUT_SIGNALS_PATTERN])
     num_days = st.sidebar.slider('Number of days', 1, 7, 2)
-    rows = get_trending_stock(num_days)
+    breakout_days = 20
+    if 'N-day Breakout' in patterns_selected:
+        breakout_days = st.sidebar.slider('Breakout days', 5, 250, 20)
+    matches = scan_candlestick_patterns(tuple(patterns_selected), num_days, breakout_days)
+    st.dataframe(matches)
 
-    # List that will be populated with symbols that return from the function get_trending_stock()
-    symbols_filtered = [""]
+    # Symbols that return from the scanner, each one listed once even when it matched several patterns or days
+    matched_symbols = list(dict.fromkeys(matches['symbol']))
 
-    # For loop to unpack the symbols from the function and append them to the list above
-    for row in rows:
-        symbols_filtered.append(row['symbol'])
-
-    # Select box that is populated with the list of symbols that were appended in the for Loop
-    symbol_selected = st.sidebar.selectbox(label="Symbols", options=symbols_filtered, )
+    # Select box that is populated with the list of symbols matched
+    symbol_selected = st.sidebar.selectbox(label="Symbols", options=[""] + matched_symbols, )
 
     # IF statement use to determine
     # IF there is a symbol selected from the Selectbox to only show the graph for that symbol
-    # IF not then show all the symbols that matched the SQL results
-    if symbol_selected == '':
-        for row in rows:
-            st.image(f"https://finviz.com/chart.ashx?t={row['symbol']}")
-    else:
-        st.image(f"https://finviz.com/chart.ashx?t={symbol_selected}")
+    # IF not then show all the symbols that matched, one page of the grid at a time
+    thumbnail_symbols = matched_symbols if symbol_selected == '' else [symbol_selected]
+    page_count = max(1, -(-len(thumbnail_symbols) // THUMBNAILS_PER_PAGE))
+    thumbnail_page = st.sidebar.number_input('Charts page', min_value=1, max_value=page_count, value=1)
+    page_symbols = thumbnail_symbols[(thumbnail_page - 1) * THUMBNAILS_PER_PAGE:thumbnail_page * THUMBNAILS_PER_PAGE]
+    thumbnails = get_thumbnails(tuple(page_symbols))
+    if page_symbols:
+        with measure("thumbnail grid"):
+            thumbnail_grid = st.columns(min(THUMBNAIL_COLUMNS, len(page_symbols)))
+            for position, page_symbol in enumerate(page_symbols):
+                if page_symbol in thumbnails:
+                    thumbnail_grid[position % THUMBNAIL_COLUMNS].image(thumbnails[page_symbol], caption=page_symbol,
+                                                                       use_column_width=True)
+
+# Diagnostics panel, only shown when the app is opened with ?diagnostics=1
+render_diagnostics_panel()
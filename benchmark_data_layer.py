@@ -0,0 +1,234 @@
+# Alejandro Castro Project
+# Benchmark suite for the data layer of the portfolio app. It can fill a local Postgres with a synthetic market
+# (data_stocks_daily), stocks (stock) and Reddit mentions (mention) at the scale selected, then times every data
+# function of the app cold (empty caches) and warm, recording the rows, the pickled bytes and the peak memory of each
+# call. Results are written as JSON so runs can be compared to catch regressions.
+#
+# The database is the one in .streamlit/secrets.toml under [wbets], the same one the app uses, so point it to a local
+# Postgres before generating data. Examples:
+#   python benchmark_data_layer.py --generate --symbols 500 --years 10 --mentions 1000000
+#   python benchmark_data_layer.py --output after.json --compare before.json
+import argparse
+import io
+import json
+import pickle
+import platform
+import shutil
+import statistics
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+import psycopg2
+import streamlit as st
+
+import Streamlit_Portfolio_App as portfolio_app
+
+# Tables created by the app on top of the raw data, dropped when a new dataset is generated
+DERIVED_TABLES = ["breakout_signals", "breakout_signals_watermark", "symbol_stats", "mention_daily_counts",
+                  "mention_rollup_watermark"]
+# Folders of files the app derives from the database, removed when a new dataset is generated and before the cold
+# runs that measure building them
+LOCAL_STORE_DIRS = [portfolio_app.OHLC_STORE_DIR, portfolio_app.SCREENER_DIR, portfolio_app.THUMBNAIL_CACHE_DIR]
+# Caches the app keeps for the whole process as singletons, cleared with the memo caches before every cold run. The
+# connection pool, the locks and the executors are singletons too but they don't hold any data.
+CACHE_SINGLETONS = [portfolio_app.get_mention_index, portfolio_app.get_indicator_cache]
+# Letters of every synthetic symbol
+SYMBOL_LETTERS = 4
+MENTION_WORDS = ["moon", "calls", "puts", "yolo", "tendies", "diamond", "hands", "short", "squeeze", "earnings",
+                 "buy", "hold", "dip", "rocket", "bagholder", "gain", "loss", "options", "dd", "bullish", "bearish"]
+
+
+# Function to remove the local files derived from the database, so the next call builds them again
+def clear_local_stores():
+    for store_dir in LOCAL_STORE_DIRS:
+        shutil.rmtree(store_dir, ignore_errors=True)
+
+
+# Function to send a DataFrame to a table with COPY, the fastest way to load rows into Postgres
+def copy_frame(cursor, df, table_name):
+    buffer = io.StringIO()
+    df.to_csv(buffer, index=False, header=False)
+    buffer.seek(0)
+    cursor.copy_expert(f"COPY {table_name} ({', '.join(df.columns)}) FROM STDIN WITH CSV", buffer)
+
+
+# Function to name the synthetic symbol of a number with four letters (AAAA, AAAB, ...), since the app only lists the
+# symbols shorter than five characters
+def synthetic_symbol(number):
+    return "".join(chr(ord("A") + number // 26 ** power % 26) for power in range(SYMBOL_LETTERS - 1, -1, -1))
+
+
+# Function that generates the synthetic dataset: a random walk of daily bars on business days for every symbol, and
+# mentions spread over the last days of the history, more of them for the first symbols like on the real forum
+def generate_dataset(symbol_count, years, mention_count, seed, replace):
+    if symbol_count > 26 ** SYMBOL_LETTERS:
+        raise SystemExit(f"At most {26 ** SYMBOL_LETTERS} symbols can be generated")
+    rng = np.random.default_rng(seed)
+    connection = psycopg2.connect(**st.secrets["wbets"])
+    with connection, connection.cursor() as cursor:
+        cursor.execute("SELECT to_regclass('data_stocks_daily') IS NOT NULL")
+        if cursor.fetchone()[0] and not replace:
+            cursor.execute("SELECT EXISTS (SELECT 1 FROM data_stocks_daily)")
+            if cursor.fetchone()[0]:
+                raise SystemExit("data_stocks_daily already has rows, use --replace to overwrite them")
+
+        cursor.execute(f"DROP TABLE IF EXISTS data_stocks_daily, mention, stock, {', '.join(DERIVED_TABLES)}")
+        cursor.execute("""
+                CREATE TABLE stock (id SERIAL PRIMARY KEY, symbol TEXT NOT NULL, name TEXT);
+                CREATE TABLE data_stocks_daily (
+                    index BIGSERIAL PRIMARY KEY, symbol TEXT NOT NULL, date TIMESTAMP NOT NULL,
+                    open NUMERIC, high NUMERIC, low NUMERIC, close NUMERIC);
+                CREATE TABLE mention (
+                    id BIGSERIAL PRIMARY KEY, stock_id INTEGER NOT NULL REFERENCES stock (id),
+                    dt TIMESTAMP NOT NULL, message TEXT, url TEXT, author TEXT);
+                """)
+
+        symbols = [synthetic_symbol(number) for number in range(symbol_count)]
+        copy_frame(cursor, pd.DataFrame({"symbol": symbols, "name": [f"{symbol} Corp" for symbol in symbols]}),
+                   "stock")
+
+        dates = pd.bdate_range(end=pd.Timestamp.today().normalize(), periods=int(years * 252))
+        for symbol in symbols:
+            close = 50 * np.exp(np.cumsum(rng.normal(0.0003, 0.02, len(dates))))
+            open_price = close * np.exp(rng.normal(0, 0.01, len(dates)))
+            high = np.maximum(open_price, close) * (1 + rng.exponential(0.01, len(dates)))
+            low = np.minimum(open_price, close) * (1 - rng.exponential(0.01, len(dates)))
+            copy_frame(cursor, pd.DataFrame({"symbol": symbol, "date": dates, "open": open_price.round(4),
+                                             "high": high.round(4), "low": low.round(4), "close": close.round(4)}),
+                       "data_stocks_daily")
+
+        mention_batch = 200000
+        popularity = 1 / np.arange(1, symbol_count + 1)
+        popularity /= popularity.sum()
+        last_mention = pd.Timestamp.today().normalize()
+        for batch_start in range(0, mention_count, mention_batch):
+            batch_size = min(mention_batch, mention_count - batch_start)
+            words = rng.choice(MENTION_WORDS, size=(batch_size, 8))
+            stock_ids = rng.choice(symbol_count, size=batch_size, p=popularity) + 1
+            copy_frame(cursor, pd.DataFrame({
+                "stock_id": stock_ids,
+                "dt": last_mention - pd.to_timedelta(rng.integers(0, 60 * 86400, batch_size), unit="s"),
+                "message": [" ".join(row) for row in words],
+                "url": [f"https://www.reddit.com/r/wallstreetbets/comments/{number}"
+                        for number in range(batch_start, batch_start + batch_size)],
+                "author": [f"user{number}" for number in rng.integers(0, 50000, batch_size)]}), "mention")
+
+        cursor.execute("ANALYZE data_stocks_daily; ANALYZE stock; ANALYZE mention")
+    connection.close()
+    portfolio_app.create_database_indexes()
+    clear_local_stores()
+    return {"symbols": symbol_count, "years": years, "bars": symbol_count * len(dates), "mentions": mention_count}
+
+
+# Function to run a benchmark case. The cold run starts with every memo cache and cache singleton cleared, the warm
+# runs repeat the call as a rerun of the app would. The size of the result is measured by pickling it, the same way
+# memo caches store it.
+def run_case(name, func, repeats, before_cold_run=None):
+    st.experimental_memo.clear()
+    for cache_singleton in CACHE_SINGLETONS:
+        cache_singleton.clear()
+    if before_cold_run is not None:
+        before_cold_run()
+
+    tracemalloc.start()
+    start_time = time.perf_counter()
+    result = func()
+    cold_seconds = time.perf_counter() - start_time
+    peak_memory = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    warm_seconds = []
+    for _ in range(repeats):
+        start_time = time.perf_counter()
+        func()
+        warm_seconds.append(time.perf_counter() - start_time)
+
+    case_result = {"name": name,
+                   "cold_seconds": cold_seconds,
+                   "warm_seconds_median": statistics.median(warm_seconds) if warm_seconds else None,
+                   "rows": len(result) if hasattr(result, "__len__") else None,
+                   "bytes": len(pickle.dumps(result)),
+                   "peak_memory_bytes": peak_memory}
+    warm_text = f"{case_result['warm_seconds_median'] * 1000:8.2f} ms" if warm_seconds else f"{'n/a':>11}"
+    print(f"{name:<45} cold {cold_seconds * 1000:10.1f} ms   warm {warm_text}   rows {case_result['rows']}"
+          f"   peak {peak_memory / 1e6:8.1f} MB")
+    return case_result
+
+
+# Cases of the benchmark, one for every data function of the app plus the resampling of the Search tab
+def benchmark_cases(sample_symbol, comparison_symbols):
+    cases = [("get_symbol_list", portfolio_app.get_symbol_list, None),
+             (f"get_data_search({sample_symbol}) cold store", lambda: portfolio_app.get_data_search(sample_symbol),
+              clear_local_stores),
+             (f"get_data_search({sample_symbol}) synced store", lambda: portfolio_app.get_data_search(sample_symbol),
+              None),
+             (f"get_comparison_closes({len(comparison_symbols)} symbols) cold store",
+              lambda: portfolio_app.get_comparison_closes(comparison_symbols, 365), clear_local_stores),
+             ("get_mentions_page", portfolio_app.get_mentions_page, None),
+             ("search_mentions(short squeeze)", lambda: portfolio_app.search_mentions("short squeeze"), None),
+             ("get_trending_stock(2)", lambda: portfolio_app.get_trending_stock(2), None),
+             ("scan_candlestick_patterns(all)",
+              lambda: portfolio_app.scan_candlestick_patterns(tuple(portfolio_app.SCANNER_PATTERNS), 2, 20), None),
+             ("screen_stocks(top decile 20-day return) cold matrix", lambda: portfolio_app.screen_stocks(20, 90),
+              clear_local_stores),
+             ("screen_stocks(top decile 20-day return) synced matrix", lambda: portfolio_app.screen_stocks(20, 90),
+              None)]
+    for num_days in (1, 15, 30):
+        cases.append((f"get_data_wsbt({num_days})", lambda num_days=num_days: portfolio_app.get_data_wsbt(num_days),
+                      None))
+    for timeframe in ("Day", "Week", "Month", "Year"):
+        cases.append((f"get_search_bars({sample_symbol}, {timeframe})",
+                      lambda timeframe=timeframe: portfolio_app.get_search_bars(sample_symbol, timeframe), None))
+        cases.append((f"resample_ohlc({sample_symbol}, {timeframe})",
+                      lambda timeframe=timeframe: portfolio_app.resample_ohlc(
+                          *portfolio_app.read_store_arrays(sample_symbol, "day"), timeframe)[0], None))
+    return cases
+
+
+# Function to print how every case changed compared with a previous run
+def compare_results(results, previous_path):
+    with open(previous_path) as previous_file:
+        previous = {case["name"]: case for case in json.load(previous_file)["results"]}
+    print(f"\nCompared with {previous_path}:")
+    for case in results:
+        if case["name"] in previous and previous[case["name"]]["cold_seconds"]:
+            ratio = case["cold_seconds"] / previous[case["name"]]["cold_seconds"]
+            print(f"{case['name']:<45} cold x{ratio:6.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the data layer of the portfolio app")
+    parser.add_argument("--generate", action="store_true", help="generate a synthetic dataset first")
+    parser.add_argument("--replace", action="store_true", help="allow --generate to overwrite existing tables")
+    parser.add_argument("--symbols", type=int, default=500)
+    parser.add_argument("--years", type=float, default=10)
+    parser.add_argument("--mentions", type=int, default=1000000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeats", type=int, default=5, help="warm runs of every case")
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--compare", help="JSON of a previous run to compare with")
+    args = parser.parse_args()
+
+    scale = None
+    if args.generate:
+        start_time = time.perf_counter()
+        scale = generate_dataset(args.symbols, args.years, args.mentions, args.seed, args.replace)
+        print(f"Generated {scale} in {time.perf_counter() - start_time:.1f} seconds")
+
+    symbols = [row["symbol"] for row in portfolio_app.get_symbol_list(min_bars=0)]
+    if not symbols:
+        raise SystemExit("The app lists no symbols in data_stocks_daily, generate a dataset with --generate first")
+    results = [run_case(name, func, args.repeats, before_cold_run)
+               for name, func, before_cold_run in benchmark_cases(symbols[0], symbols[:20])]
+
+    with open(args.output, "w") as output_file:
+        json.dump({"created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                   "scale": scale,
+                   "environment": {"python": platform.python_version(), "numpy": np.__version__,
+                                   "pandas": pd.__version__, "machine": platform.machine()},
+                   "results": results}, output_file, indent=2, default=str)
+    print(f"\nResults written to {args.output}")
+    if args.compare:
+        compare_results(results, args.compare)
@@ -0,0 +1,31 @@
+# Alejandro Castro Project
+# Drawing of the chart thumbnails of the 📈 Trending tab. It lives in its own module so the app can send
+# render_thumbnail to a process pool: functions are sent to worker processes by reference, and the workers import this
+# small module instead of running the app script.
+import os
+
+
+# Function to draw a compact candlestick chart of a symbol with Pillow, saved to the thumbnail cache. The image is
+# written to a temporary file first so a session never reads a thumbnail that is half written.
+def render_thumbnail(symbol, bars, thumbnail_path, size):
+    from PIL import Image, ImageDraw
+
+    width, height = size
+    image = Image.new("RGB", size, "white")
+    draw = ImageDraw.Draw(image)
+    lowest, highest = bars[:, 2].min(), bars[:, 1].max()
+    scale = (height - 22) / (highest - lowest) if highest > lowest else 0
+    candle_ys = height - 4 - (bars - lowest) * scale
+    candle_width = width / len(bars)
+    for position, (open_y, high_y, low_y, close_y) in enumerate(candle_ys):
+        center = (position + 0.5) * candle_width
+        color = "#3D9970" if close_y <= open_y else "#FF4136"
+        draw.line([(center, high_y), (center, low_y)], fill=color)
+        draw.rectangle([center - candle_width * 0.35, min(open_y, close_y),
+                        center + candle_width * 0.35, max(open_y, close_y)], fill=color)
+    draw.text((4, 2), symbol, fill="black")
+
+    temporary_path = f"{thumbnail_path}.{os.getpid()}.tmp"
+    image.save(temporary_path, format="PNG")
+    os.replace(temporary_path, thumbnail_path)
+    return thumbnail_path
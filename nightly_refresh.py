@@ -0,0 +1,17 @@
+# Alejandro Castro Project
+# Nightly job that creates the indexes the app relies on, then brings the breakout signals, the mention rollup, the
+# local OHLC store and its Week, Month and Year pyramid up to date for every symbol in data_stocks_daily, so the
+# 🔎 Search for Stocks tab only reads precomputed candles. Run it once after deploying a new version too, before the
+# first page view.
+# Schedule it after the daily bars are loaded, for example with cron:
+#   0 2 * * * cd /path/to/Streamlit_Portfolio_App && python nightly_refresh.py
+import time
+
+import Streamlit_Portfolio_App as portfolio_app
+
+if __name__ == "__main__":
+    start_time = time.perf_counter()
+    indexes = portfolio_app.create_database_indexes()
+    print(f"Checked {len(indexes)} indexes in {time.perf_counter() - start_time:.1f} seconds")
+    symbols_refreshed = portfolio_app.refresh_all_symbols()
+    print(f"Refreshed {symbols_refreshed} symbols in {time.perf_counter() - start_time:.1f} seconds")
@@ -0,0 +1,129 @@
+# Alejandro Castro Project
+# Tests of the company profile cache of the 🔎 Search for Stocks tab, with a stub fetcher in place of Yahoo Finance.
+# The app is imported the same way nightly_refresh.py does, and the cache folder is swapped for a temporary one.
+#   python -m unittest test_company_profiles
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+import Streamlit_Portfolio_App as portfolio_app
+
+WAIT_SECONDS = 5
+
+
+# Stub of fetch_yahoo_company_info that returns the profiles given in order, or raises them when they are exceptions,
+# and counts the calls for every symbol. A fetch can be held until release is set.
+class StubFetcher:
+    def __init__(self, *replies, release=None):
+        self.replies = list(replies)
+        self.release = release
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def __call__(self, ticker):
+        with self.lock:
+            self.calls.append(ticker)
+            reply = self.replies.pop(0) if len(self.replies) > 1 else self.replies[0]
+        if self.release is not None:
+            self.release.wait(WAIT_SECONDS)
+        if isinstance(reply, Exception):
+            raise reply
+        return dict(reply) if reply is not None else None
+
+
+class CompanyProfileCacheTest(unittest.TestCase):
+    def setUp(self):
+        cache_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(cache_dir.cleanup)
+        patcher = mock.patch.object(portfolio_app, "COMPANY_CACHE_DIR", cache_dir.name)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    # Function to wait until the profile cached for a symbol is the one expected
+    def wait_for_cached_profile(self, ticker, profile):
+        deadline = time.monotonic() + WAIT_SECONDS
+        while time.monotonic() < deadline:
+            if portfolio_app.read_company_cache(ticker)[0] == profile:
+                return
+            time.sleep(0.01)
+        self.fail(f"the profile of {ticker} was not refreshed")
+
+    def test_missing_profile_is_fetched_and_cached(self):
+        fetcher = StubFetcher({"longName": "Alpha Corp"})
+        self.assertEqual(portfolio_app.get_company_profile("ALFA", fetcher), {"longName": "Alpha Corp"})
+        self.assertEqual(portfolio_app.read_company_cache("ALFA")[0], {"longName": "Alpha Corp"})
+        self.assertEqual(fetcher.calls, ["ALFA"])
+
+    def test_fresh_profile_is_served_from_the_cache(self):
+        portfolio_app.write_company_cache("BETA", {"longName": "Beta Corp"})
+        fetcher = StubFetcher({"longName": "Beta Corp (new)"})
+        self.assertEqual(portfolio_app.get_company_profile("BETA", fetcher), {"longName": "Beta Corp"})
+        self.assertEqual(fetcher.calls, [])
+
+    def test_stale_profile_is_served_and_refreshed_in_the_background(self):
+        portfolio_app.write_company_cache("GAMA", {"longName": "Gamma Corp"})
+        release = threading.Event()
+        fetcher = StubFetcher({"longName": "Gamma Corp (new)"}, release=release)
+
+        # The stale profile comes back right away, while the fetch is still held
+        self.assertEqual(portfolio_app.get_company_profile("GAMA", fetcher, ttl=-1), {"longName": "Gamma Corp"})
+        release.set()
+        self.wait_for_cached_profile("GAMA", {"longName": "Gamma Corp (new)"})
+        self.assertEqual(portfolio_app.get_company_profile("GAMA", fetcher), {"longName": "Gamma Corp (new)"})
+        self.assertEqual(fetcher.calls, ["GAMA"])
+
+    def test_failed_or_empty_fetch_falls_back_to_the_last_profile(self):
+        portfolio_app.write_company_cache("DLTA", {"longName": "Delta Corp"})
+        for reply in (RuntimeError("API down"), {}, None):
+            with self.subTest(reply=reply):
+                profile = portfolio_app.refresh_company_profile("DLTA", StubFetcher(reply))
+                self.assertEqual(profile, {"longName": "Delta Corp"})
+                self.assertEqual(portfolio_app.read_company_cache("DLTA")[0], {"longName": "Delta Corp"})
+
+    def test_failed_fetch_without_a_cached_profile_returns_an_empty_profile(self):
+        self.assertEqual(portfolio_app.refresh_company_profile("EPSI", StubFetcher(RuntimeError("API down"))), {})
+        self.assertEqual(portfolio_app.read_company_cache("EPSI"), (None, None))
+
+    def test_prefetch_fetches_every_symbol_once(self):
+        portfolio_app.write_company_cache("FRSH", {"longName": "Fresh Corp"})
+        release = threading.Event()
+        fetcher = StubFetcher({"longName": "Prefetched Corp"}, release=release)
+
+        prefetches = portfolio_app.prefetch_company_profiles(["ZETA", "ZETA", "ETA", "FRSH"], fetcher)
+        # A second prefetch while the first fetches are still running doesn't request the same symbols again
+        self.assertEqual(portfolio_app.prefetch_company_profiles(["ZETA", "ETA"], fetcher), [])
+        release.set()
+        for prefetch in prefetches:
+            prefetch.result(WAIT_SECONDS)
+
+        self.assertEqual(len(prefetches), 2)
+        self.assertEqual(sorted(fetcher.calls), ["ETA", "ZETA"])
+        self.assertEqual(portfolio_app.read_company_cache("ZETA")[0], {"longName": "Prefetched Corp"})
+        self.assertEqual(portfolio_app.read_company_cache("FRSH")[0], {"longName": "Fresh Corp"})
+
+    def test_prefetch_start_returns_before_the_cache_is_read(self):
+        release = threading.Event()
+        fetcher = StubFetcher({"longName": "Theta Corp"})
+        prefetch_company_profiles = portfolio_app.prefetch_company_profiles
+
+        def held_prefetch(tickers):
+            release.wait(WAIT_SECONDS)
+            return prefetch_company_profiles(tickers, fetcher)
+
+        portfolio_app.start_company_profile_prefetch.clear()
+        self.addCleanup(portfolio_app.start_company_profile_prefetch.clear)
+        with mock.patch.object(portfolio_app, "prefetch_company_profiles", held_prefetch):
+            scan = portfolio_app.start_company_profile_prefetch(("THTA",))
+            self.assertFalse(scan.done())
+            # The same symbol list doesn't start a second scan
+            self.assertIs(portfolio_app.start_company_profile_prefetch(("THTA",)), scan)
+            release.set()
+            for prefetch in scan.result(WAIT_SECONDS):
+                prefetch.result(WAIT_SECONDS)
+        self.assertEqual(portfolio_app.read_company_cache("THTA")[0], {"longName": "Theta Corp"})
+
+
+if __name__ == "__main__":
+    unittest.main()